@@ -26,8 +26,2663 @@ import os
 import sys
 import hashlib
 from datetime import datetime
-import shutil
 import shlex
+import time
+import queue
+import threading
+import argparse
+import base64
+import io
+import re
+import math
+import zlib
+import uuid
+import itertools
+import mmap
+import struct
+import locale
+import zipfile
+import cProfile
+import pstats
+import functools
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape as xml_escape
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+DEFAULT_CONFIG = {
+    'password_enabled': False,
+    'password_hash': None,
+    'auto_backup': True,
+    'theme': 'default',
+    'watch_interval_ms': 1000,
+    'journal_mode': 'wal',
+    'busy_timeout_ms': 5000,
+    'write_retries': 5,
+    'read_pool_size': 3,
+    'serve_host': '127.0.0.1',
+    'serve_port': 8765,
+    'query_cache_mb': 32,
+    'auto_vacuum': 'incremental',
+    'maintenance_enabled': True,
+    'maintenance_idle_seconds': 30,
+    'maintenance_step_ms': 100,
+    'maintenance_vacuum_pages': 64,
+    'maintenance_optimize_hours': 24,
+    'export_workers': 4,
+    'memory_mode': False,
+    'memory_max_mb': 256,
+    'memory_save_seconds': 60,
+    'write_behind': False,
+    'write_behind_ms': 2000,
+    'write_behind_edits': 50,
+    'profiler_top_n': 15,
+    'profiler_dump': False,
+    'grid_preview_chars': 200
+}
+
+# Internal bookkeeping tables start with this prefix and are hidden from table lists
+INTERNAL_PREFIX = '_pdb_'
+TABLES_SQL = ("SELECT name FROM sqlite_master WHERE type='table' "
+              "AND name NOT LIKE '\\_pdb\\_%' ESCAPE '\\' ORDER BY name")
+
+# Compressed cells are BLOBs starting with this marker, followed by zlib data
+COMPRESSED_MARKER = b'\x00PDBZ'
+COMPRESS_MIN_BYTES = 256
+
+# Above this many pages the fragmentation scan is left to 'maintain report'
+FRAGMENTATION_SCAN_MAX_PAGES = 100000
+
+
+def read_config(config_path):
+    """Read config.json, filling in defaults for settings it doesn't have yet"""
+    config = dict(DEFAULT_CONFIG)
+    if os.path.exists(config_path):
+        with open(config_path, 'r') as f:
+            config.update(json.load(f))
+    return config
+
+
+def quote_ident(name):
+    """Quote a table/column name for use in SQL"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def zcompress(value):
+    """SQL function: zlib-compress long text, leave everything else alone"""
+    if isinstance(value, str):
+        data = value.encode('utf-8')
+        if len(data) >= COMPRESS_MIN_BYTES:
+            packed = COMPRESSED_MARKER + zlib.compress(data, 6)
+            if len(packed) < len(data):
+                return packed
+    return value
+
+
+def zdecompress(value):
+    """SQL function: inverse of zcompress; plain values pass through unchanged"""
+    if isinstance(value, bytes) and value.startswith(COMPRESSED_MARKER):
+        return zlib.decompress(value[len(COMPRESSED_MARKER):]).decode('utf-8')
+    return value
+
+
+def cell_preview(value, limit):
+    """SQL function: grid text for a cell, long text cut to limit characters.
+    
+    BLOBs are summarized by size and compressed text is only inflated as
+    far as the preview needs, so the cost does not grow with the cell.
+    """
+    if isinstance(value, bytes):
+        if not value.startswith(COMPRESSED_MARKER):
+            return f"<BLOB {len(value)} bytes>"
+        inflater = zlib.decompressobj()
+        # UTF-8 needs at most 4 bytes per character
+        text = inflater.decompress(value[len(COMPRESSED_MARKER):], limit * 4 + 4).decode('utf-8', 'ignore')
+        if len(text) <= limit and inflater.eof:
+            return text
+        return f"{text[:limit]}… [compressed]"
+    if isinstance(value, str) and len(value) > limit:
+        return f"{value[:limit]}… [{len(value)} chars]"
+    return value
+
+
+def row_hash(*values):
+    """SQL function: 16-byte content hash of a row's values (type-sensitive)"""
+    digest = hashlib.blake2b(digest_size=16)
+    for value in values:
+        digest.update(type(value).__name__.encode('ascii'))
+        digest.update(b'\x1f')
+        digest.update(repr(value).encode('utf-8', 'surrogatepass'))
+        digest.update(b'\x1e')
+    return digest.digest()
+
+
+def register_sql_functions(conn):
+    """Make the app's SQL functions available on a connection"""
+    conn.create_function('zcompress', 1, zcompress, deterministic=True)
+    conn.create_function('zdecompress', 1, zdecompress, deterministic=True)
+    conn.create_function('row_hash', -1, row_hash, deterministic=True)
+    conn.create_function('cell_preview', 2, cell_preview, deterministic=True)
+
+
+def compressed_columns(conn, table, schema='main'):
+    """Names of the columns of table stored compressed"""
+    try:
+        rows = conn.execute(f"SELECT column_name FROM {schema}.{INTERNAL_PREFIX}compressed_columns "
+                            "WHERE table_name = ?", (table,)).fetchall()
+    except sqlite3.OperationalError:
+        return set()  # nothing has ever been compressed in this database
+    return {r[0] for r in rows}
+
+
+def select_list(conn, table, with_rowid=False):
+    """SELECT column list for table that decompresses compressed columns"""
+    compressed = compressed_columns(conn, table)
+    if not compressed:
+        return "rowid, *" if with_rowid else "*"
+    parts = ['rowid'] if with_rowid else []
+    for c in conn.execute(f"PRAGMA table_info({quote_ident(table)})").fetchall():
+        name = c[1]
+        parts.append(f"zdecompress({quote_ident(name)}) AS {quote_ident(name)}"
+                     if name in compressed else quote_ident(name))
+    return ', '.join(parts)
+
+
+def preview_list(conn, table, limit):
+    """SELECT column list for the grid: rowid plus cell previews (see cell_preview).
+    
+    Plain columns are cut with substr()/length() inside SQLite so large
+    values never reach Python or Tk; compressed ones go through cell_preview.
+    """
+    compressed = compressed_columns(conn, table)
+    parts = ['rowid']
+    for c in conn.execute(f"PRAGMA table_info({quote_ident(table)})").fetchall():
+        col = quote_ident(c[1])
+        if c[1] in compressed:
+            expr = f"cell_preview({col}, {int(limit)})"
+        else:
+            expr = (f"CASE WHEN typeof({col}) = 'blob' THEN '<BLOB ' || length({col}) || ' bytes>' "
+                    f"WHEN typeof({col}) = 'text' AND length({col}) > {int(limit)} "
+                    f"THEN substr({col}, 1, {int(limit)}) || '… [' || length({col}) || ' chars]' "
+                    f"ELSE {col} END")
+        parts.append(f"{expr} AS {col}")
+    return ', '.join(parts)
+
+
+def search_condition(conn, table):
+    """WHERE condition matching rows where the rowid or any column contains :pattern.
+    
+    :pattern is a LIKE pattern with '\\' as the escape character; compressed
+    columns are inflated for the match only.
+    """
+    compressed = compressed_columns(conn, table)
+    parts = ["rowid LIKE :pattern ESCAPE '\\'"]
+    for c in conn.execute(f"PRAGMA table_info({quote_ident(table)})").fetchall():
+        col = quote_ident(c[1])
+        expr = f"zdecompress({col})" if c[1] in compressed else col
+        parts.append(f"{expr} LIKE :pattern ESCAPE '\\'")
+    return ' OR '.join(parts)
+
+
+def search_pattern(term):
+    """LIKE pattern for search_condition(): term anywhere, its % _ and \\ taken literally"""
+    return '%' + re.sub(r'([\\%_])', r'\\\1', term) + '%'
+
+
+def value_placeholders(columns, compressed):
+    """VALUES placeholders that compress values bound for compressed columns"""
+    return ', '.join('zcompress(?)' if c in compressed else '?' for c in columns)
+
+
+def assignments(columns, compressed):
+    """SET clause (col = ?, ...) that compresses values for compressed columns"""
+    return ', '.join(f"{c} = zcompress(?)" if c in compressed else f"{c} = ?" for c in columns)
+
+
+def is_busy_error(error):
+    """True if a sqlite3 error means another connection holds the lock"""
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+class ConnectionManager:
+    """Owns the single writer connection and a small pool of read-only connections.
+    
+    The database is switched to WAL so readers never block the writer (or each
+    other), every connection waits up to busy_timeout_ms for a lock, and
+    writes that still hit SQLITE_BUSY are retried with exponential backoff.
+    
+    With memory_max_mb set, a file up to that size is instead loaded into a
+    shared in-memory database and only written back by save().
+    """
+    
+    def __init__(self, db_path, busy_timeout_ms=5000, pool_size=3,
+                 write_retries=5, journal_mode='wal', auto_vacuum=None,
+                 memory_max_mb=None):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.pool_size = max(0, pool_size)
+        self.write_retries = write_retries
+        self._pool = queue.Queue()
+        self._pool_lock = threading.Lock()
+        self._readers = []
+        self.write_lock = threading.RLock()
+        self.explicit_transaction = False
+        # Thread whose transaction the writer is in (only it may read through the writer)
+        self._writer_thread = None
+        # Writes queued by run_write(defer=True) and the errors of the last flush()
+        self._queued = []
+        self.flush_errors = []
+        self._version_conn = None
+        self._version_lock = threading.Lock()
+        self.memory = False
+        self.memory_note = None
+        self._memory_uri = None
+        self._saved_signature = None
+        self._dirty_marks = 0
+        # The file's journal mode and on-disk identity when it was loaded into memory
+        self._file_journal_mode = None
+        self._file_identity = None
+        
+        if memory_max_mb is not None:
+            self.memory_note = self._load_into_memory(memory_max_mb)
+            if self.memory:
+                if auto_vacuum and self.writer.execute(
+                        "SELECT 1 FROM sqlite_master LIMIT 1").fetchone() is None:
+                    self.writer.execute(f"PRAGMA auto_vacuum={auto_vacuum}")
+                self.journal_mode = 'memory'
+                self._saved_signature = self.change_signature()
+                return
+        
+        self.writer = self._connect()
+        # auto_vacuum can only be chosen before the first table is created
+        # (and before switching to WAL)
+        if auto_vacuum and self.writer.execute(
+                "SELECT 1 FROM sqlite_master LIMIT 1").fetchone() is None:
+            self.writer.execute(f"PRAGMA auto_vacuum={auto_vacuum}")
+        # WAL is not available everywhere (e.g. network shares); keep whatever we get
+        self.journal_mode = self.writer.execute(
+            f"PRAGMA journal_mode={journal_mode}").fetchone()[0].lower()
+        if self.journal_mode == 'wal':
+            # Durable at checkpoints, far fewer fsyncs on flash drives
+            self.writer.execute("PRAGMA synchronous=NORMAL")
+    
+    @classmethod
+    def from_config(cls, db_path, config):
+        """Build a manager using the connection settings from config.json"""
+        return cls(
+            db_path,
+            busy_timeout_ms=config.get('busy_timeout_ms', 5000),
+            pool_size=config.get('read_pool_size', 3),
+            write_retries=config.get('write_retries', 5),
+            journal_mode=config.get('journal_mode', 'wal'),
+            auto_vacuum=config.get('auto_vacuum', 'incremental'),
+            memory_max_mb=config.get('memory_max_mb', 256) if config.get('memory_mode') else None
+        )
+    
+    def _connect(self, readonly=False, memory_uri=None):
+        memory_uri = memory_uri or self._memory_uri
+        if memory_uri:
+            conn = sqlite3.connect(memory_uri, uri=True, timeout=self.busy_timeout_ms / 1000,
+                                   check_same_thread=False)
+            if readonly:
+                # Shared-cache readers would otherwise take table locks that
+                # make the writer fail with "database table is locked"
+                conn.execute("PRAGMA query_only=1")
+                conn.execute("PRAGMA read_uncommitted=1")
+        elif readonly:
+            uri = 'file:' + self.db_path.replace('?', '%3f').replace('#', '%23') + '?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, timeout=self.busy_timeout_ms / 1000,
+                                   check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000,
+                                   check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.row_factory = sqlite3.Row
+        register_sql_functions(conn)
+        return conn
+    
+    @contextmanager
+    def reader(self, committed_only=False):
+        """Borrow a read-only connection from the pool.
+        
+        While the writer has an open transaction, the thread that opened it
+        is handed the writer itself, so its reads see the changes that have
+        not been committed yet; every other thread gets a pooled connection
+        and only sees committed data. Background threads pass
+        committed_only=True to always get a pooled connection of their own.
+        """
+        if self.writer.in_transaction:
+            use_writer = self._writer_thread == threading.get_ident()
+        else:
+            use_writer = self.pool_size == 0
+        if use_writer and not committed_only:
+            yield self.writer
+            return
+        if self.memory:
+            # Shared-cache readers use read_uncommitted (see _connect), so
+            # wait for another thread's transaction to end like a busy lock
+            deadline = time.monotonic() + self.busy_timeout_ms / 1000
+            while self.writer.in_transaction:
+                if time.monotonic() > deadline:
+                    raise sqlite3.OperationalError("database is locked")
+                time.sleep(0.01)
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                if len(self._readers) < max(self.pool_size, 1):
+                    conn = self._connect(readonly=True)
+                    self._readers.append(conn)
+                else:
+                    conn = None
+            if conn is None:
+                conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._pool.put(conn)
+    
+    def data_version(self):
+        """A counter that changes whenever any connection commits.
+        
+        PRAGMA data_version ignores commits made by the connection asking, so
+        it is read from a dedicated connection that never writes; that way our
+        own writer's commits count as well as other instances'.
+        """
+        if self.memory:
+            # Only the writer can change an in-memory database
+            return self.change_signature()
+        with self._version_lock:
+            if self._version_conn is None:
+                self._version_conn = self._connect(readonly=True)
+            return self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+    
+    def begin(self):
+        """Open an explicit transaction; writes stay pending until end()"""
+        with self.write_lock:
+            if self.explicit_transaction:
+                raise sqlite3.OperationalError("A transaction is already open")
+            self.flush()
+            self.writer.execute("BEGIN")
+            self.explicit_transaction = True
+            self._writer_thread = threading.get_ident()
+    
+    def end(self, commit=True):
+        """Commit (or roll back) the explicit transaction opened by begin()"""
+        with self.write_lock:
+            if not self.explicit_transaction:
+                raise sqlite3.OperationalError("No transaction is open")
+            if commit:
+                self.writer.commit()
+            else:
+                self.writer.rollback()
+            self.explicit_transaction = False
+    
+    def commit(self):
+        """Commit pending writes, unless an explicit transaction defers them"""
+        if not self.explicit_transaction:
+            self.writer.commit()
+    
+    @property
+    def pending_edits(self):
+        """Number of writes queued by run_write(defer=True) and not yet flushed"""
+        return len(self._queued)
+    
+    def flush(self):
+        """Run the writes queued by run_write(defer=True) in one transaction.
+        
+        Each queued write gets its own savepoint: one that fails is undone
+        and skipped, and its error is kept in flush_errors, so a single bad
+        edit can't hold back the others. Lock errors are retried like any
+        write; if the flush still fails, the queue is kept for the next try.
+        Returns how many writes were applied.
+        """
+        with self.write_lock:
+            if self.explicit_transaction or not self._queued:
+                return 0
+            queued, self._queued = self._queued, []
+            errors = []
+            
+            def apply(conn):
+                errors.clear()
+                if not conn.in_transaction:
+                    conn.execute("BEGIN")
+                for func in queued:
+                    conn.execute("SAVEPOINT deferred_edit")
+                    try:
+                        func(conn)
+                    except sqlite3.Error as e:
+                        conn.execute("ROLLBACK TO deferred_edit")
+                        conn.execute("RELEASE deferred_edit")
+                        if is_busy_error(e):
+                            raise
+                        errors.append(e)
+                        continue
+                    conn.execute("RELEASE deferred_edit")
+            
+            try:
+                self.run_write(apply)
+            except Exception:
+                self._queued = queued + self._queued
+                raise
+            self.flush_errors = errors
+            return len(queued) - len(errors)
+    
+    def run_write(self, func, defer=False):
+        """Call func(writer) and commit, retrying with backoff while the DB is locked.
+        
+        Inside an explicit transaction the write is neither committed nor
+        retried: SQLite already undid the failed statement and the rest of
+        the transaction is left for the user to commit or roll back.
+        
+        With defer=True the write is only queued (and None returned):
+        flush() later runs the whole queue in one short transaction, so a
+        burst of edits costs one commit (one fsync) and no lock is held on
+        the file in between. Other writes flush the queued edits first.
+        """
+        delay = 0.05
+        with self.write_lock:
+            if self.explicit_transaction:
+                return func(self.writer)
+            if defer:
+                self._queued.append(func)
+                return None
+            self._writer_thread = threading.get_ident()
+            if self._queued:
+                self.flush()
+            for attempt in range(self.write_retries + 1):
+                try:
+                    result = func(self.writer)
+                    self.writer.commit()
+                    return result
+                except Exception as e:
+                    # Never leave a half-applied write pending on the shared writer
+                    if self.writer.in_transaction:
+                        self.writer.rollback()
+                    busy = isinstance(e, sqlite3.OperationalError) and is_busy_error(e)
+                    if not busy or attempt == self.write_retries:
+                        raise
+                    time.sleep(delay)
+                    delay = min(delay * 2, 2.0)
+    
+    def write(self, sql, params=()):
+        """Execute one statement on the writer and commit it (with retry)"""
+        return self.run_write(lambda conn: conn.execute(sql, params))
+    
+    @contextmanager
+    def snapshot_readers(self, count):
+        """Open count new read-only connections that all see the same snapshot.
+        
+        Each connection starts a read transaction while commits are held
+        off: our own writers by write_lock, other processes by a short
+        BEGIN IMMEDIATE on a gate connection. Once that is released the
+        readers keep their (identical) snapshot until the block ends,
+        without blocking anyone. Uncommitted changes of an explicit
+        transaction are not visible to them.
+        
+        In memory mode there is no WAL to give snapshots, so the readers
+        share a private in-memory copy taken with the backup API instead
+        (which needs any explicit transaction to be finished first).
+        """
+        if self.memory:
+            if self.writer.in_transaction:
+                raise sqlite3.OperationalError("Commit or roll back the open transaction first")
+            uri = f"file:pdb-{uuid.uuid4().hex}?mode=memory&cache=shared"
+            copy = self._connect(memory_uri=uri)
+            try:
+                with self.write_lock:
+                    self.writer.backup(copy)
+                readers = [self._connect(readonly=True, memory_uri=uri) for _ in range(count)]
+                try:
+                    yield readers
+                finally:
+                    for conn in readers:
+                        conn.close()
+            finally:
+                copy.close()
+            return
+        readers = []
+        try:
+            with self.write_lock:
+                gate = None
+                if not self.writer.in_transaction:
+                    gate = self._connect()
+                    gate.execute("BEGIN IMMEDIATE")
+                try:
+                    for _ in range(count):
+                        conn = self._connect(readonly=True)
+                        readers.append(conn)
+                        conn.execute("BEGIN")
+                        conn.execute("SELECT count(*) FROM sqlite_master").fetchone()
+                finally:
+                    if gate is not None:
+                        gate.rollback()
+                        gate.close()
+            yield readers
+        finally:
+            for conn in readers:
+                conn.close()
+    
+    def _load_into_memory(self, max_mb):
+        """Copy the database file into a shared in-memory database.
+        
+        Returns None on success, or the reason for staying in file mode:
+        the file is bigger than max_mb, or another process has it open in
+        WAL mode (replacing the file under it would not be safe).
+        """
+        size = sum(os.path.getsize(p) for p in (self.db_path, self.db_path + '-wal')
+                   if os.path.exists(p))
+        if size > max_mb * 1048576:
+            return (f"{size / 1048576:.1f} MB is more than memory_max_mb ({max_mb} MB); "
+                    "working on the file directly")
+        source = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000)
+        try:
+            original = source.execute("PRAGMA journal_mode").fetchone()[0].lower()
+            if original == 'wal':
+                # Fold the WAL into the file; save() replaces the file wholesale
+                mode = source.execute("PRAGMA journal_mode=DELETE").fetchone()[0].lower()
+                if mode != 'delete':
+                    return "the database is open in another program; working on the file directly"
+            self._memory_uri = f"file:pdb-{uuid.uuid4().hex}?mode=memory&cache=shared"
+            self.writer = self._connect()
+            if source.execute("PRAGMA page_count").fetchone()[0]:
+                # (a brand-new file is skipped so auto_vacuum can still be set)
+                source.backup(self.writer)
+            if original == 'wal':
+                source.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.Error as e:
+            self._memory_uri = None
+            return f"could not load the database into memory ({e}); working on the file directly"
+        finally:
+            source.close()
+        self.memory = True
+        self._file_journal_mode = original
+        self._file_identity = self._read_file_identity()
+        return None
+    
+    def _read_file_identity(self):
+        """Size, mtime and header of the database file and its WAL.
+        
+        The headers carry SQLite's file change counter and WAL salts, so a
+        commit by another program changes this even when size and mtime
+        (2-second steps on FAT sticks) don't.
+        """
+        identity = []
+        for path in (self.db_path, self.db_path + '-wal'):
+            try:
+                stat = os.stat(path)
+                with open(path, 'rb') as f:
+                    header = f.read(32)
+            except FileNotFoundError:
+                stat = None
+            # An empty WAL (another program only reading) is the same as none
+            identity.append((stat.st_size, stat.st_mtime_ns, header) if stat and stat.st_size else None)
+        return tuple(identity)
+    
+    def change_signature(self):
+        """Changes whenever the in-memory database has been modified"""
+        schema = self.writer.execute("PRAGMA schema_version").fetchone()[0]
+        return (self.writer.total_changes, self._dirty_marks, schema)
+    
+    def mark_dirty(self):
+        """Flag a change that total_changes can't see (e.g. a restore via backup)"""
+        self._dirty_marks += 1
+    
+    @property
+    def unsaved_changes(self):
+        return self.memory and self.change_signature() != self._saved_signature
+    
+    def save(self, path=None):
+        """Write the in-memory database back to its file (memory mode only).
+        
+        The copy goes to a temporary file next to the target, is fsynced, then
+        atomically renamed over it, so a crash or pulled USB stick leaves
+        either the old file or the new one, never a mix. If another program
+        has changed the file since it was loaded, the save is refused rather
+        than overwrite its changes (save to another path instead). Returns
+        False when there was nothing to save.
+        """
+        if not self.memory:
+            return False
+        target = path or self.db_path
+        with self.write_lock:
+            self.flush()
+            if self.writer.in_transaction:
+                raise sqlite3.OperationalError("Commit or roll back the open transaction first")
+            signature = self.change_signature()
+            if path is None and signature == self._saved_signature:
+                return False
+            if path is None and self._read_file_identity() != self._file_identity:
+                raise sqlite3.OperationalError(
+                    f"{self.db_path} was changed by another program since it was loaded; "
+                    "saving over it would lose those changes")
+            temp = target + '.saving'
+            if os.path.exists(temp):
+                os.remove(temp)
+            try:
+                copy = sqlite3.connect(temp)
+                try:
+                    self.writer.backup(copy)
+                    if self._file_journal_mode == 'wal':
+                        copy.execute("PRAGMA journal_mode=WAL")
+                finally:
+                    copy.close()
+                with open(temp, 'rb+') as f:
+                    os.fsync(f.fileno())
+                os.replace(temp, target)
+            except BaseException:
+                if os.path.exists(temp):
+                    os.remove(temp)
+                raise
+            try:
+                # Make the rename itself durable (not possible on Windows)
+                dir_fd = os.open(os.path.dirname(os.path.abspath(target)), os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+            except OSError:
+                pass
+            if path is None:
+                self._saved_signature = signature
+                self._file_identity = self._read_file_identity()
+        return True
+    
+    def close(self):
+        """Close the pooled readers and the writer (committing queued edits)"""
+        if self.pending_edits:
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass  # already reported by the caller; closing rolls them back
+        with self._pool_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers = []
+            self._pool = queue.Queue()
+        with self._version_lock:
+            if self._version_conn is not None:
+                self._version_conn.close()
+                self._version_conn = None
+        self.writer.close()
+
+
+# ---------- Query result cache ----------
+_SQL_LITERAL_OR_SPACE = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])|\s+""")
+_NONDETERMINISTIC_SQL = re.compile(
+    r"\b(random|randomblob|changes|total_changes|last_insert_rowid|current_date|"
+    r"current_time|current_timestamp)\b|'now'", re.IGNORECASE)
+
+
+def normalize_sql(sql):
+    """Collapse whitespace outside string literals and drop trailing semicolons"""
+    sql = _SQL_LITERAL_OR_SPACE.sub(lambda m: m.group(1) or ' ', sql).strip()
+    return sql.rstrip(';').rstrip()
+
+
+def _estimate_size(rows):
+    """Rough memory footprint in bytes of a list of result rows"""
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += 64 + sum(sys.getsizeof(v) for v in row)
+    return size
+
+
+class QueryCache:
+    """LRU cache of read-query results, bounded by an approximate byte budget.
+    
+    Entries are keyed on normalized SQL plus parameters and tagged with the
+    data_version they were read at; as soon as the database changes every
+    entry is dropped, so a hit never returns stale rows.
+    """
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._version = None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def cacheable(sql):
+        return not _NONDETERMINISTIC_SQL.search(sql)
+    
+    @staticmethod
+    def make_key(sql, params=()):
+        if isinstance(params, dict):
+            params = tuple(sorted(params.items()))
+        return (normalize_sql(sql), tuple(params))
+    
+    def get(self, key, version):
+        """Return (columns, rows) or None; counts the lookup as a hit or miss"""
+        if version != self._version:
+            self.clear()
+            self._version = version
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0], entry[1]
+    
+    def put(self, key, version, columns, rows):
+        if version != self._version or self.max_bytes <= 0:
+            return
+        size = _estimate_size(rows)
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[2]
+        self._entries[key] = (columns, rows, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, _, evicted) = self._entries.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+    
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        rate = f"{100 * self.hits / lookups:.0f}%" if lookups else "n/a"
+        return (f"Query cache: {len(self._entries)} entries, "
+                f"{self.bytes / 1048576:.2f} / {self.max_bytes / 1048576:.0f} MB, "
+                f"hits {self.hits}, misses {self.misses} (hit rate {rate}), "
+                f"evictions {self.evictions}")
+
+
+# ---------- Import ----------
+IMPORT_MODES = ('append', 'skip-duplicates', 'upsert')
+IMPORT_BATCH_SIZE = 1000
+
+
+def parse_import_mode(tokens):
+    """Parse 'append' | 'skip-duplicates [on col,...]' | 'upsert on col,...'.
+    
+    Returns (mode, key_columns); key_columns is None when not given.
+    """
+    if isinstance(tokens, str):
+        tokens = tokens.split()
+    if not tokens:
+        return 'append', None
+    mode = tokens[0].lower()
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"Import mode must be one of: {', '.join(IMPORT_MODES)}")
+    key_columns = None
+    if len(tokens) > 1:
+        if tokens[1].lower() != 'on' or len(tokens) < 3:
+            raise ValueError(f"Expected '{mode} on col1,col2'")
+        key_columns = [c for c in ','.join(tokens[2:]).replace(' ', ',').split(',') if c]
+    if mode == 'upsert' and not key_columns:
+        raise ValueError("upsert needs key columns: upsert on col1,col2")
+    if mode == 'append' and key_columns:
+        raise ValueError("append doesn't take key columns")
+    return mode, key_columns
+
+
+def unique_keys(conn, table):
+    """Column lists of table's PRIMARY KEY and full, plain-column UNIQUE indexes"""
+    keys = []
+    info = conn.execute(f"PRAGMA table_info({quote_ident(table)})").fetchall()
+    pk = [c[1] for c in sorted(info, key=lambda c: c[5]) if c[5]]
+    if len(pk) == 1 and [c[2].upper() for c in info if c[1] == pk[0]] == ['INTEGER']:
+        keys.append(pk)  # rowid alias: not listed by index_list
+    for index in conn.execute(f"PRAGMA index_list({quote_ident(table)})").fetchall():
+        if not index[2] or index[4]:
+            continue  # not unique, or partial
+        cols = [c[2] for c in conn.execute(f"PRAGMA index_info({quote_ident(index[1])})")]
+        if cols and None not in cols:
+            keys.append(cols)
+    return keys
+
+
+def prepare_import(conn, table, columns, mode='append', key_columns=None):
+    """Create the table (and key index) if needed; return the per-row INSERT.
+    
+    Keyed modes use a UNIQUE index or primary key that already covers the
+    key columns, and only create one (replacing any the importer made for
+    other keys) when there is none. skip-duplicates without keys skips a
+    row if one the same in every column exists; it uses a plain index,
+    so later appends of identical rows still work, and compares with IS,
+    so empty (NULL) cells match too.
+    """
+    columns_def = ', '.join([f"{col} TEXT" for col in columns])
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns_def})")
+    
+    columns_str = ', '.join(columns)
+    placeholders = value_placeholders(columns, compressed_columns(conn, table))
+    sql = f"INSERT INTO {table} ({columns_str}) VALUES ({placeholders})"
+    if mode == 'append':
+        return sql
+    existing = unique_keys(conn, table)
+    if not key_columns:
+        if any(all(c in columns for c in key) for key in existing):
+            # The table's own keys define what a duplicate is
+            return sql + " ON CONFLICT DO NOTHING"
+        index = quote_ident(f"{INTERNAL_PREFIX}ix_{table}_rows")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {table} ({columns_str})")
+        values = ', '.join(f"{p} AS {c}" for p, c in zip(placeholders.split(', '), columns))
+        same = ' AND '.join(f"t.{c} IS n.{c}" for c in columns)
+        return (f"INSERT INTO {table} ({columns_str}) SELECT * FROM (SELECT {values}) AS n "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {table} AS t WHERE {same})")
+    keys = list(key_columns)
+    unknown = [k for k in keys if k not in columns]
+    if unknown:
+        raise ValueError(f"Key column(s) not in the file: {', '.join(unknown)}")
+    if not any(set(key) == set(keys) for key in existing):
+        prefix = f"{INTERNAL_PREFIX}uq_{table}_"
+        for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                    "AND tbl_name = ? AND substr(name, 1, ?) = ?",
+                                    (table, len(prefix), prefix)).fetchall():
+            conn.execute(f"DROP INDEX {quote_ident(name)}")
+        index = quote_ident(prefix + '_'.join(keys))
+        try:
+            conn.execute(f"CREATE UNIQUE INDEX {index} ON {table} ({', '.join(keys)})")
+        except sqlite3.IntegrityError:
+            raise ValueError(f"'{table}' already has duplicate rows on ({', '.join(keys)}); "
+                             "remove them before importing with this mode")
+    updates = [c for c in columns if c not in keys]
+    if mode == 'upsert' and updates:
+        return (sql + f" ON CONFLICT ({', '.join(keys)}) DO UPDATE SET "
+                + ', '.join(f"{c} = excluded.{c}" for c in updates))
+    return sql + " ON CONFLICT DO NOTHING"
+
+
+def import_conflict_error(conn, table, error):
+    """ValueError explaining a row that clashes with a UNIQUE key the import mode doesn't use"""
+    keys = ' or '.join(f"({', '.join(k)})" for k in unique_keys(conn, table)) or 'a key'
+    return ValueError(f"A row has the same {keys} as one already in '{table}' ({error}); "
+                      "import with 'skip-duplicates' or 'upsert on' those columns")
+
+
+def import_rows(conn, table, columns, rows, mode='append', key_columns=None,
+                batch_size=IMPORT_BATCH_SIZE):
+    """Insert rows (sequences of values in columns order) into table.
+    
+    The table is created with TEXT columns if needed. skip-duplicates and
+    upsert resolve each row against an index on the key columns (see
+    prepare_import), so the cost depends on the file, not on the size of
+    the table. Rows go in through executemany in batches. Returns
+    {'read': rows read, 'changed': rows inserted or updated}.
+    """
+    sql = prepare_import(conn, table, columns, mode, key_columns)
+    width = len(columns)
+    read = changed = 0
+    rows = iter(rows)
+    while True:
+        # Pad short rows / trim long ones so every batch binds cleanly
+        batch = [(list(row) + [None] * width)[:width]
+                 for row in itertools.islice(rows, batch_size)]
+        if not batch:
+            break
+        try:
+            changed += conn.executemany(sql, batch).rowcount
+        except sqlite3.IntegrityError as e:
+            if 'UNIQUE' not in str(e):
+                raise
+            raise import_conflict_error(conn, table, e) from e
+        read += len(batch)
+    return {'read': read, 'changed': changed}
+
+
+def describe_import(result, mode):
+    """One-line summary of an import_rows() result"""
+    rejected = result.get('rejected', 0)
+    if rejected:
+        note = f", {rejected} bad row(s) written to {result['reject_path']}"
+        result = dict(result, read=result['read'] - rejected)
+    else:
+        note = ''
+    if mode == 'append':
+        return f"{result['read']} row(s) imported" + note
+    skipped = result['read'] - result['changed']
+    if mode == 'upsert':
+        return f"{result['read']} row(s) read, {result['changed']} inserted or updated" + note
+    return (f"{result['read']} row(s) read, {result['changed']} inserted, "
+            f"{skipped} duplicate(s) skipped" + note)
+
+
+# ---------- Resumable CSV import ----------
+IMPORT_CHECKPOINT_ROWS = 20000
+CHECKPOINTS_TABLE = f"{INTERNAL_PREFIX}import_checkpoints"
+
+
+def file_fingerprint(path, sample=65536):
+    """Size plus a hash of the first and last 64 KB; cheap even for multi-GB files"""
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(sample))
+        if size > sample:
+            f.seek(max(size - sample, sample))
+            digest.update(f.read(sample))
+    return f"{size}:{digest.hexdigest()}"
+
+
+def import_checkpoint(conn, path, table):
+    """The saved checkpoint of an unfinished import of path into table, or None"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+                    (CHECKPOINTS_TABLE,)).fetchone() is None:
+        return None
+    return conn.execute(f"SELECT * FROM {CHECKPOINTS_TABLE} WHERE path = ? AND table_name = ?",
+                        (os.path.abspath(path), table)).fetchone()
+
+
+def _csv_records(f, encoding):
+    """Yield (fields, end offset, decoded cleanly) for each record of a binary CSV file.
+    
+    csv.reader pulls exactly the lines a record needs, so the byte count of
+    the lines handed out so far is the offset just past that record (even
+    for quoted fields spanning several lines).
+    """
+    state = {'offset': f.tell(), 'clean': True}
+    
+    def lines():
+        while True:
+            line = f.readline()
+            if not line:
+                return
+            state['offset'] += len(line)
+            if state['offset'] == len(line) and line.startswith(b'\xef\xbb\xbf'):
+                line = line[3:]  # UTF-8 byte order mark
+            try:
+                yield line.decode(encoding)
+            except UnicodeDecodeError:
+                state['clean'] = False
+                yield line.decode(encoding, errors='replace')
+    
+    for fields in csv.reader(lines()):
+        yield fields, state['offset'], state['clean']
+        state['clean'] = True
+
+
+def _max_rowid(conn, table):
+    """Largest rowid in table (0 when empty), or None for a WITHOUT ROWID table"""
+    try:
+        return conn.execute(f"SELECT coalesce(max(rowid), 0) FROM {table}").fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+
+def _added_rowids(conn, table, added, before, inserted):
+    """added plus the range of rowids a chunk just appended, or None if they aren't one range.
+    
+    Nobody else writes during the chunk's transaction, so every rowid above
+    the old maximum is new; the range holds all of the chunk's rows unless
+    some were given lower rowids of their own.
+    """
+    if before is None:
+        return None
+    if not inserted:
+        return added
+    first, last, count = conn.execute(
+        f"SELECT min(rowid), max(rowid), count(*) FROM {table} WHERE rowid > ?", (before,)).fetchone()
+    if count != inserted:
+        return None
+    if added and added[-1][1] == first - 1:
+        return added[:-1] + [[added[-1][0], last]]
+    return added + [[first, last]]
+
+
+def _discard_partial_import(db, saved, table):
+    """Delete the rows an interrupted append import added, along with its checkpoint"""
+    if saved['mode'] == 'append' and saved['rows_changed'] and not saved['added_rowids']:
+        raise ValueError(f"The rows the earlier import added to '{table}' can't be told apart "
+                         "from the rest, so it can't be restarted; add 'resume' to continue it instead")
+    ranges = json.loads(saved['added_rowids']) if saved['mode'] == 'append' else []
+    
+    def discard(conn):
+        for first, last in ranges:
+            conn.execute(f"DELETE FROM {table} WHERE rowid BETWEEN ? AND ?", (first, last))
+        conn.execute(f"DELETE FROM {CHECKPOINTS_TABLE} WHERE path = ? AND table_name = ?",
+                     (saved['path'], table))
+    db.run_write(discard)
+
+
+def import_csv_resumable(db, path, table, mode='append', key_columns=None, resume=False,
+                         restart=False, reject_path=None, checkpoint_rows=IMPORT_CHECKPOINT_ROWS):
+    """Import a CSV file in committed chunks that survive an interruption.
+    
+    Every checkpoint_rows rows are committed together with a checkpoint in
+    _pdb_import_checkpoints: the byte offset reached, the running counts
+    and the file's fingerprint. If the run is cut short (a yanked drive,
+    the app closing, a full disk) resume=True seeks to the last checkpoint
+    and carries on with the same mode; restart=True starts again from the
+    top. Because of the chunked commits the import is not atomic: rows of
+    an interrupted run stay in the table. An append run records the rowid
+    ranges it added, and restart deletes them before starting over; if
+    they can't be told apart (rows with their own INTEGER PRIMARY KEY
+    values, a WITHOUT ROWID table) restarting an append is refused.
+    Rows SQLite refuses (constraint or type errors) and lines that don't
+    decode are written to reject_path (default <file>.rejected.csv) with
+    the reason, instead of aborting the import.
+    Returns {'read', 'changed', 'rejected', 'reject_path', 'resumed_at', 'mode'}.
+    """
+    path = os.path.abspath(path)
+    fingerprint = file_fingerprint(path)
+    saved = import_checkpoint(db.writer, path, table)
+    if saved and not (resume or restart):
+        raise ValueError(f"An earlier import of this file into '{table}' stopped after "
+                         f"{saved['rows_read']} row(s). Add 'resume' to continue it "
+                         "or 'restart' to start over.")
+    if resume:
+        if not saved:
+            raise ValueError(f"There is no unfinished import of this file into '{table}' to resume")
+        if saved['fingerprint'] != fingerprint:
+            raise ValueError("The file has changed since the import was interrupted; "
+                             "use 'restart' to import it from the beginning")
+        mode = saved['mode']
+        key_columns = json.loads(saved['key_columns']) if saved['key_columns'] else None
+    elif restart and saved:
+        _discard_partial_import(db, saved, table)
+    reject_path = reject_path or os.path.splitext(path)[0] + '.rejected.csv'
+    totals = {'read': 0, 'changed': 0, 'rejected': 0}
+    if resume:
+        totals = {'read': saved['rows_read'], 'changed': saved['rows_changed'],
+                  'rejected': saved['rows_rejected']}
+    resumed_at = totals['read']
+    # Rowid ranges [first, last] added by this import (append only); None once untrackable
+    added = [] if mode == 'append' else None
+    if resume and mode == 'append':
+        added = json.loads(saved['added_rowids']) if saved['added_rowids'] else None
+    encoding = locale.getpreferredencoding(False)
+    
+    def commit_chunk(chunk, bad_lines, offset):
+        nonlocal added
+        
+        def run(conn):
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            sql = prepare_import(conn, table, columns, mode, key_columns)
+            ranges = _max_rowid(conn, table) if added is not None else None
+            # Summed per statement: total_changes would also count rolled-back
+            # batches and the rows that triggers touch
+            changed = 0
+            refused = []
+            for i in range(0, len(chunk), IMPORT_BATCH_SIZE):
+                batch = chunk[i:i + IMPORT_BATCH_SIZE]
+                conn.execute("SAVEPOINT import_batch")
+                try:
+                    changed += conn.executemany(sql, batch).rowcount
+                except (sqlite3.IntegrityError, sqlite3.DataError):
+                    # Find the offending rows one by one; keep the rest
+                    conn.execute("ROLLBACK TO import_batch")
+                    for row in batch:
+                        try:
+                            changed += conn.execute(sql, row).rowcount
+                        except (sqlite3.IntegrityError, sqlite3.DataError) as e:
+                            refused.append((row, str(e)))
+                conn.execute("RELEASE import_batch")
+            if ranges is not None:
+                ranges = _added_rowids(conn, table, added, ranges, len(chunk) - len(refused))
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {CHECKPOINTS_TABLE} ("
+                         "path TEXT NOT NULL, table_name TEXT NOT NULL, fingerprint TEXT NOT NULL, "
+                         "mode TEXT NOT NULL, key_columns TEXT, byte_offset INTEGER NOT NULL, "
+                         "rows_read INTEGER NOT NULL, rows_changed INTEGER NOT NULL, "
+                         "rows_rejected INTEGER NOT NULL, updated TEXT, added_rowids TEXT, "
+                         "PRIMARY KEY (path, table_name))")
+            conn.execute(
+                f"INSERT OR REPLACE INTO {CHECKPOINTS_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, table, fingerprint, mode, json.dumps(key_columns) if key_columns else None,
+                 offset, totals['read'] + len(chunk) + len(bad_lines),
+                 totals['changed'] + changed, totals['rejected'] + len(bad_lines) + len(refused),
+                 datetime.now().isoformat(timespec='seconds'),
+                 json.dumps(ranges) if ranges is not None else None))
+            return changed, refused, ranges
+        
+        changed, refused, ranges = db.run_write(run)
+        added = ranges
+        totals['read'] += len(chunk) + len(bad_lines)
+        totals['changed'] += changed
+        write_rejects(bad_lines + refused)
+    
+    def write_rejects(rows):
+        nonlocal reject_file, reject_writer
+        totals['rejected'] += len(rows)
+        if not rows:
+            return
+        if reject_writer is None:
+            appending = resume and os.path.exists(reject_path)
+            reject_file = open(reject_path, 'a' if appending else 'w', newline='', encoding='utf-8')
+            reject_writer = csv.writer(reject_file)
+            if not appending:
+                reject_writer.writerow(columns + ['import_error'])
+        for row, error in rows:
+            reject_writer.writerow(list(row) + [error])
+        reject_file.flush()
+    
+    reject_file = reject_writer = None
+    try:
+        with open(path, 'rb') as f:
+            records = _csv_records(f, encoding)
+            header = next(records, None)
+            if not header or not header[0]:
+                raise ValueError("CSV has no header row")
+            columns = header[0]
+            width = len(columns)
+            if resume:
+                f.seek(saved['byte_offset'])
+                records = _csv_records(f, encoding)
+            chunk, bad_lines = [], []
+            offset = f.tell() if resume else header[1]
+            for fields, offset, clean in records:
+                # Pad short rows / trim long ones, as import_rows does
+                row = (fields + [None] * width)[:width]
+                if clean:
+                    chunk.append(row)
+                else:
+                    bad_lines.append((row, f"not valid {encoding} text"))
+                if len(chunk) + len(bad_lines) >= checkpoint_rows:
+                    commit_chunk(chunk, bad_lines, offset)
+                    chunk, bad_lines = [], []
+            if chunk or bad_lines or not resume:
+                commit_chunk(chunk, bad_lines, offset)
+        
+        def finish(conn):
+            conn.execute(f"DELETE FROM {CHECKPOINTS_TABLE} WHERE path = ? AND table_name = ?",
+                         (path, table))
+        db.run_write(finish)
+    finally:
+        if reject_file is not None:
+            reject_file.close()
+    return dict(totals, reject_path=reject_path, resumed_at=resumed_at, mode=mode)
+
+
+# ---------- Excel (XLSX) ----------
+XLSX_MAX_ROWS = 1048576  # Excel's limit per sheet, header row included
+_XLSX_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_XLSX_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+_XLSX_INT = re.compile(r'^-?\d+$')
+
+
+def _xlsx_sheet_name(table, number):
+    name = re.sub(r'[\[\]:*?/\\]', '_', str(table))[:31] or 'Sheet'
+    if number > 1:
+        suffix = f" ({number})"
+        name = name[:31 - len(suffix)] + suffix
+    return name
+
+
+def _xlsx_cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+        return f'<c><v>{value!r}</v></c>'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = base64.b64encode(bytes(value)).decode('ascii')
+    text = xml_escape(_XML_ILLEGAL.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def write_xlsx(path, cursor, sheet_name='Sheet1', split_sheets=True, batch_size=1000):
+    """Stream a cursor's rows into an .xlsx file with constant memory.
+    
+    Each worksheet is written straight into its zip member as rows arrive,
+    using inline strings (no shared-strings table to hold in memory). Past
+    Excel's row limit a new sheet is started with the header repeated, or
+    ValueError is raised if split_sheets is False. Returns the row count.
+    """
+    columns = [d[0] for d in cursor.description]
+    header = '<row r="1">' + ''.join(_xlsx_cell(c) for c in columns) + '</row>'
+    sheet_start = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                   f'<worksheet xmlns="{_XLSX_NS}"><sheetData>')
+    sheet_end = '</sheetData></worksheet>'
+    sheets = []
+    total = 0
+    
+    zf = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+    member = None
+    try:
+        row_number = XLSX_MAX_ROWS  # forces the first sheet to open
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch and member is not None:
+                break
+            for row in batch or [None]:
+                if row_number >= XLSX_MAX_ROWS:
+                    if member is not None:
+                        if not split_sheets:
+                            raise ValueError(f"More than {XLSX_MAX_ROWS - 1} rows; enable sheet splitting")
+                        member.write(sheet_end.encode('utf-8'))
+                        member.close()
+                    sheets.append(_xlsx_sheet_name(sheet_name, len(sheets) + 1))
+                    member = zf.open(f'xl/worksheets/sheet{len(sheets)}.xml', 'w', force_zip64=True)
+                    member.write((sheet_start + header).encode('utf-8'))
+                    row_number = 1
+                if row is None:
+                    continue
+                row_number += 1
+                total += 1
+                member.write((f'<row r="{row_number}">' + ''.join(_xlsx_cell(v) for v in row)
+                              + '</row>').encode('utf-8'))
+        member.write(sheet_end.encode('utf-8'))
+        member.close()
+        
+        overrides = ''.join(
+            f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="application/'
+            f'vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            for i in range(1, len(sheets) + 1))
+        zf.writestr('[Content_Types].xml',
+                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                    '<Default Extension="xml" ContentType="application/xml"/>'
+                    '<Override PartName="/xl/workbook.xml" ContentType="application/'
+                    'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                    + overrides + '</Types>')
+        zf.writestr('_rels/.rels',
+                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                    f'<Relationship Id="rId1" Type="{_XLSX_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+                    '</Relationships>')
+        zf.writestr('xl/workbook.xml',
+                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    f'<workbook xmlns="{_XLSX_NS}" xmlns:r="{_XLSX_REL_NS}"><sheets>'
+                    + ''.join(f'<sheet name="{xml_escape(name, {chr(34): "&quot;"})}" sheetId="{i}" r:id="rId{i}"/>'
+                              for i, name in enumerate(sheets, 1))
+                    + '</sheets></workbook>')
+        zf.writestr('xl/_rels/workbook.xml.rels',
+                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                    + ''.join(f'<Relationship Id="rId{i}" Type="{_XLSX_REL_NS}/worksheet" '
+                              f'Target="worksheets/sheet{i}.xml"/>' for i in range(1, len(sheets) + 1))
+                    + '</Relationships>')
+        zf.close()
+    except BaseException:
+        # Don't leave a half-written workbook behind
+        if member is not None:
+            member.close()
+        zf.close()
+        os.remove(path)
+        raise
+    return total
+
+
+def _xlsx_column_index(ref):
+    """'C5' -> 2"""
+    index = 0
+    for ch in ref:
+        if not ch.isalpha():
+            break
+        index = index * 26 + (ord(ch.upper()) - 64)
+    return index - 1
+
+
+def _xlsx_sheets(zf):
+    """[(name, member path)] in workbook order"""
+    workbook = ET.fromstring(zf.read('xl/workbook.xml'))
+    rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+    targets = {r.get('Id'): r.get('Target') for r in rels}
+    sheets = []
+    for sheet in workbook.iter(f'{{{_XLSX_NS}}}sheet'):
+        target = targets.get(sheet.get(f'{{{_XLSX_REL_NS}}}id'), '')
+        target = target.lstrip('/') if target.startswith('/') else 'xl/' + target
+        sheets.append((sheet.get('name'), target))
+    return sheets
+
+
+def iter_xlsx_rows(path, sheet=None, all_sheets=False):
+    """Yield the rows of an .xlsx sheet as lists, header row first.
+    
+    The sheet XML is walked with iterparse and each row is cleared and
+    detached from <sheetData> once read, so memory stays flat however
+    large the sheet is (only the shared-strings table, if the file has
+    one, is held). With all_sheets, the data rows of every sheet are
+    yielded after the first sheet's header; each further sheet's own
+    header row is skipped.
+    """
+    with zipfile.ZipFile(path) as zf:
+        shared = []
+        if 'xl/sharedStrings.xml' in zf.namelist():
+            sst = None
+            for event, si in ET.iterparse(zf.open('xl/sharedStrings.xml'), events=('start', 'end')):
+                if sst is None:
+                    sst = si  # the <sst> root, parent of every <si>
+                elif event == 'end' and si.tag == f'{{{_XLSX_NS}}}si':
+                    shared.append(''.join(t.text or '' for t in si.iter(f'{{{_XLSX_NS}}}t')))
+                    sst.remove(si)
+        sheets = _xlsx_sheets(zf)
+        if not sheets:
+            raise ValueError("Workbook has no sheets")
+        if sheet is not None:
+            sheets = [s for s in sheets if s[0] == sheet]
+            if not sheets:
+                raise ValueError(f"No sheet named '{sheet}'")
+        elif not all_sheets:
+            sheets = sheets[:1]
+        
+        sheet_data_tag = f'{{{_XLSX_NS}}}sheetData'
+        row_tag = f'{{{_XLSX_NS}}}row'
+        cell_tag = f'{{{_XLSX_NS}}}c'
+        value_tag = f'{{{_XLSX_NS}}}v'
+        text_tag = f'{{{_XLSX_NS}}}t'
+        for sheet_number, (_, member) in enumerate(sheets):
+            first_row = True
+            sheet_data = None
+            for event, elem in ET.iterparse(zf.open(member), events=('start', 'end')):
+                if event == 'start':
+                    if elem.tag == sheet_data_tag:
+                        sheet_data = elem
+                    continue
+                if elem.tag != row_tag:
+                    continue
+                values = []
+                for cell in elem.iter(cell_tag):
+                    ref = cell.get('r')
+                    if ref:
+                        values.extend([None] * (_xlsx_column_index(ref) - len(values)))
+                    kind = cell.get('t', 'n')
+                    v = cell.find(value_tag)
+                    if kind == 'inlineStr':
+                        value = ''.join(t.text or '' for t in cell.iter(text_tag))
+                    elif v is None or v.text is None:
+                        value = None
+                    elif kind == 's':
+                        value = shared[int(v.text)]
+                    elif kind == 'b':
+                        value = int(v.text)
+                    elif kind in ('str', 'e'):
+                        value = v.text
+                    else:
+                        value = int(v.text) if _XLSX_INT.match(v.text) else float(v.text)
+                    values.append(value)
+                elem.clear()
+                if sheet_data is not None:
+                    sheet_data.remove(elem)
+                if first_row and sheet_number > 0:
+                    first_row = False
+                    continue
+                first_row = False
+                yield values
+
+
+# ---------- Columnar snapshots ----------
+# File layout: SNAPSHOT_MAGIC, one block per column part (each padded to 8
+# bytes), the JSON directory, then the directory length (uint64) and the
+# magic again. Numbers are little-endian. The directory sits at the end so
+# a snapshot is written in a single pass; readers find it from the tail.
+SNAPSHOT_MAGIC = b'PDBSNAP1'
+SNAPSHOT_EXTENSION = '.pdbc'
+# Type tags of the values in 'any' columns (mixed types or BLOBs)
+_SNAPSHOT_TAGS = {type(None): 0, int: 1, float: 2, str: 3, bytes: 4}
+
+
+def _snapshot_kind(types):
+    """Storage kind for a column from the set of typeof() results it holds"""
+    types = set(types) - {'null'}
+    if types <= {'integer'}:
+        return 'int'
+    if types == {'real'}:
+        return 'float'
+    if types == {'text'}:
+        return 'text'
+    return 'any'
+
+
+def _little_endian(data):
+    """Bytes of an array in file byte order"""
+    if sys.byteorder != 'little':
+        data = array(data.typecode, data)
+        data.byteswap()
+    return data.tobytes()
+
+
+def write_snapshot(conn, table, f, batch_size=1000):
+    """Write table to the binary file f as a columnar snapshot; returns the row count.
+    
+    Integer and real columns become int64/float64 arrays (plus a one byte
+    per row NULL mask when needed), text columns a dictionary of distinct
+    strings and an int32 code per row (-1 for NULL), and anything else
+    (BLOBs, mixed types) tagged variable-length values. The table is read
+    twice, types then values, inside one read transaction.
+    """
+    own_transaction = not conn.in_transaction
+    if own_transaction:
+        conn.execute("BEGIN")
+    try:
+        info = conn.execute(f"PRAGMA table_info({quote_ident(table)})").fetchall()
+        compressed = compressed_columns(conn, table)
+        exprs = [f"zdecompress({quote_ident(c[1])})" if c[1] in compressed else quote_ident(c[1])
+                 for c in info]
+        try:
+            conn.execute(f"SELECT rowid FROM {quote_ident(table)} LIMIT 0")
+            order = "rowid"
+        except sqlite3.OperationalError:
+            # WITHOUT ROWID table
+            order = ', '.join(quote_ident(c[1]) for c in sorted(info, key=lambda c: c[5]) if c[5])
+        types = conn.execute(
+            "SELECT " + ', '.join(f"group_concat(DISTINCT typeof({e}))" for e in exprs)
+            + f" FROM {quote_ident(table)}").fetchone()
+        kinds = [_snapshot_kind((t or '').split(',')) for t in types]
+        
+        builders = []
+        for kind in kinds:
+            if kind in ('int', 'float'):
+                builders.append({'values': array('q' if kind == 'int' else 'd'), 'nulls': bytearray()})
+            elif kind == 'text':
+                builders.append({'codes': array('i'), 'dictionary': {}})
+            else:
+                builders.append({'tags': bytearray(), 'offsets': array('q', [0]), 'data': bytearray()})
+        
+        rows = 0
+        cursor = conn.execute(f"SELECT {', '.join(exprs)} FROM {quote_ident(table)} ORDER BY {order}")
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            for column, (kind, builder) in enumerate(zip(kinds, builders)):
+                values = [row[column] for row in batch]
+                if kind in ('int', 'float'):
+                    builder['nulls'].extend(v is None for v in values)
+                    builder['values'].extend(0 if v is None else v for v in values)
+                elif kind == 'text':
+                    dictionary = builder['dictionary']
+                    builder['codes'].extend(-1 if v is None else dictionary.setdefault(v, len(dictionary))
+                                            for v in values)
+                else:
+                    for v in values:
+                        builder['tags'].append(_SNAPSHOT_TAGS[type(v)])
+                        if isinstance(v, int):
+                            builder['data'] += v.to_bytes(8, 'little', signed=True)
+                        elif isinstance(v, float):
+                            builder['data'] += struct.pack('<d', v)
+                        elif isinstance(v, str):
+                            builder['data'] += v.encode('utf-8')
+                        elif v is not None:
+                            builder['data'] += v
+                        builder['offsets'].append(len(builder['data']))
+            rows += len(batch)
+    finally:
+        if own_transaction:
+            conn.rollback()
+    
+    position = len(SNAPSHOT_MAGIC)
+    f.write(SNAPSHOT_MAGIC)
+    
+    def block(data):
+        nonlocal position
+        start = position
+        f.write(data)
+        f.write(b'\0' * (-len(data) % 8))
+        position += len(data) + (-len(data) % 8)
+        return [start, len(data)]
+    
+    columns = []
+    for i, (c, kind) in enumerate(zip(info, kinds)):
+        # Let each column's buffers go as soon as it is written
+        builder, builders[i] = builders[i], None
+        entry = {'name': c[1], 'type': c[2], 'kind': kind, 'pk': c[5]}
+        if kind in ('int', 'float'):
+            entry['values'] = block(_little_endian(builder['values']))
+            if any(builder['nulls']):
+                entry['nulls'] = block(bytes(builder['nulls']))
+        elif kind == 'text':
+            strings = [s.encode('utf-8') for s in builder['dictionary']]
+            entry['strings'] = len(strings)
+            entry['offsets'] = block(_little_endian(array('q', itertools.accumulate(map(len, strings),
+                                                                                   initial=0))))
+            entry['dictionary'] = block(b''.join(strings))
+            entry['codes'] = block(_little_endian(builder['codes']))
+        else:
+            entry['tags'] = block(bytes(builder['tags']))
+            entry['offsets'] = block(_little_endian(builder['offsets']))
+            entry['data'] = block(bytes(builder['data']))
+        columns.append(entry)
+    directory = json.dumps({'version': 1, 'table': table, 'rows': rows,
+                            'columns': columns}).encode('utf-8')
+    f.write(directory)
+    f.write(len(directory).to_bytes(8, 'little') + SNAPSHOT_MAGIC)
+    return rows
+
+
+class ColumnarSnapshot:
+    """Read-only, memory-mapped view of a snapshot written by write_snapshot.
+    
+    Opening one only parses the small directory; column() decodes just the
+    rows asked for and buffer() hands out a column's numbers (or string
+    codes) without copying, e.g. sum(snapshot.buffer('amount')).
+    """
+    
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            if os.fstat(self._file.fileno()).st_size < 2 * len(SNAPSHOT_MAGIC) + 8:
+                raise ValueError(f"{path} is not a snapshot file")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._map[:8] != SNAPSHOT_MAGIC or self._map[-8:] != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a snapshot file")
+            length = int.from_bytes(self._map[-16:-8], 'little')
+            header = json.loads(self._map[-16 - length:-16].decode('utf-8'))
+        except Exception:
+            self.close()
+            raise
+        if header.get('version') != 1:
+            self.close()
+            raise ValueError(f"Unsupported snapshot version: {header.get('version')}")
+        self.table = header['table']
+        self.rows = header['rows']
+        self._columns = {c['name']: c for c in header['columns']}
+        self.columns = list(self._columns)
+        self.types = {c['name']: c['type'] for c in header['columns']}
+        self.primary_key = [c['name'] for c in sorted(header['columns'], key=lambda c: c['pk']) if c['pk']]
+        self._dictionaries = {}
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def close(self):
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+    
+    def _array(self, part, typecode, start=0, stop=None):
+        """One numeric block (or a slice of it) as an array in native byte order"""
+        offset, length = part
+        size = array(typecode).itemsize
+        start, stop, _ = slice(start, stop).indices(length // size)
+        data = array(typecode, self._map[offset + start * size:offset + max(start, stop) * size])
+        if sys.byteorder != 'little':
+            data.byteswap()
+        return data
+    
+    def _bytes(self, part, start=0, stop=None):
+        offset, length = part
+        start, stop, _ = slice(start, stop).indices(length)
+        return self._map[offset + start:offset + max(start, stop)]
+    
+    def _dictionary(self, column):
+        """Distinct strings of a text column, with None last so code -1 maps to NULL"""
+        name = column['name']
+        if name not in self._dictionaries:
+            offsets = self._array(column['offsets'], 'q')
+            data = self._bytes(column['dictionary'])
+            strings = [data[a:b].decode('utf-8') for a, b in zip(offsets, offsets[1:])]
+            self._dictionaries[name] = strings + [None]
+        return self._dictionaries[name]
+    
+    def buffer(self, name):
+        """Zero-copy memoryview of an int/float column's values or a text column's codes.
+        
+        NULLs read as 0 (or -1 for codes). Release the view before close().
+        """
+        column = self._columns[name]
+        if column['kind'] == 'any' or sys.byteorder != 'little':
+            raise ValueError(f"Column '{name}' cannot be read as a flat buffer")
+        offset, length = column['codes' if column['kind'] == 'text' else 'values']
+        typecode = {'int': 'q', 'float': 'd', 'text': 'i'}[column['kind']]
+        with memoryview(self._map) as whole:
+            return whole[offset:offset + length].cast(typecode)
+    
+    def column(self, name, start=0, stop=None):
+        """Values of one column (rows start:stop) as a list"""
+        column = self._columns[name]
+        kind = column['kind']
+        if kind in ('int', 'float'):
+            values = self._array(column['values'], 'q' if kind == 'int' else 'd', start, stop).tolist()
+            if 'nulls' in column:
+                nulls = self._bytes(column['nulls'], start, stop)
+                values = [None if null else v for v, null in zip(values, nulls)]
+            return values
+        if kind == 'text':
+            strings = self._dictionary(column)
+            return [strings[code] for code in self._array(column['codes'], 'i', start, stop)]
+        tags = self._bytes(column['tags'], start, stop)
+        offsets = self._array(column['offsets'], 'q', start, None if stop is None else stop + 1)
+        data_offset = column['data'][0]
+        values = []
+        for tag, a, b in zip(tags, offsets, offsets[1:]):
+            raw = self._map[data_offset + a:data_offset + b]
+            if tag == 1:
+                values.append(int.from_bytes(raw, 'little', signed=True))
+            elif tag == 2:
+                values.append(struct.unpack('<d', raw)[0])
+            elif tag == 3:
+                values.append(raw.decode('utf-8'))
+            elif tag == 4:
+                values.append(raw)
+            else:
+                values.append(None)
+        return values
+    
+    def iter_rows(self, columns=None, batch_size=IMPORT_BATCH_SIZE):
+        """Yield rows as tuples, decoding batch_size rows of each column at a time"""
+        columns = columns or self.columns
+        for start in range(0, self.rows, batch_size):
+            yield from zip(*(self.column(name, start, start + batch_size) for name in columns))
+
+
+def import_snapshot(conn, path, table, mode='append', key_columns=None):
+    """Load a snapshot into table, creating it with the original column types and primary key"""
+    with ColumnarSnapshot(path) as snapshot:
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+                              (table,)).fetchone()
+        if not exists:
+            columns_def = ', '.join(f"{quote_ident(name)} {snapshot.types[name]}".rstrip()
+                                    for name in snapshot.columns)
+            if snapshot.primary_key:
+                columns_def += f", PRIMARY KEY ({', '.join(map(quote_ident, snapshot.primary_key))})"
+            conn.execute(f"CREATE TABLE {quote_ident(table)} ({columns_def})")
+        return import_rows(conn, table, snapshot.columns, snapshot.iter_rows(), mode, key_columns)
+
+
+# ---------- Whole-database export ----------
+EXPORT_FORMATS = {'csv': '.csv', 'json': '.json', 'ndjson': '.ndjson', 'snapshot': SNAPSHOT_EXTENSION}
+EXPORT_MANIFEST = 'manifest.json'
+
+
+class _HashingWriter:
+    """Sink that writes text as UTF-8 (or bytes as is) to a binary file and hashes it on the way"""
+    
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+    
+    def write(self, text):
+        data = text.encode('utf-8') if isinstance(text, str) else text
+        self.sha256.update(data)
+        self.size += len(data)
+        self.f.write(data)
+        return len(text)
+
+
+def export_table_file(conn, table, path, fmt='csv', batch_size=1000):
+    """Stream one table to path as csv, json, ndjson or a columnar snapshot.
+    
+    Returns the table's manifest entry: file name, rows, bytes and sha256.
+    """
+    if fmt == 'snapshot':
+        with open(path, 'wb') as f:
+            out = _HashingWriter(f)
+            rows = write_snapshot(conn, table, out, batch_size)
+        return {'table': table, 'file': os.path.basename(path), 'rows': rows,
+                'bytes': out.size, 'sha256': out.sha256.hexdigest()}
+    cursor = conn.execute(f"SELECT {select_list(conn, table)} FROM {table}")
+    columns = [d[0] for d in cursor.description]
+    rows = 0
+    with open(path, 'wb') as f:
+        out = _HashingWriter(f)
+        if fmt == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(columns)
+        elif fmt == 'json':
+            out.write('[')
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            if fmt == 'csv':
+                writer.writerows(batch)
+                rows += len(batch)
+                continue
+            for row in batch:
+                record = dict(zip(columns, row))
+                if fmt == 'json':
+                    # Same layout as json.dump(rows, f, indent=2)
+                    text = json.dumps(record, default=_json_default, indent=2)
+                    out.write((',' if rows else '') + '\n  ' + text.replace('\n', '\n  '))
+                else:
+                    out.write(json.dumps(record, default=_json_default) + '\n')
+                rows += 1
+        if fmt == 'json':
+            out.write('\n]' if rows else ']')
+    return {'table': table, 'file': os.path.basename(path), 'rows': rows,
+            'bytes': out.size, 'sha256': out.sha256.hexdigest()}
+
+
+def export_database(db, directory, fmt='csv', workers=4):
+    """Export every user table into directory in parallel, plus a manifest.
+    
+    Each worker thread has its own read-only connection and all of them
+    share one snapshot (see ConnectionManager.snapshot_readers), so the
+    files agree with each other even while others keep writing. Biggest
+    tables are started first, so the whole export takes about as long as
+    the largest table. Returns the manifest dict.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Format must be one of: {', '.join(EXPORT_FORMATS)}")
+    os.makedirs(directory, exist_ok=True)
+    
+    with db.snapshot_readers(max(1, workers)) as readers:
+        tables = [row[0] for row in readers[0].execute(TABLES_SQL)]
+        if not tables:
+            raise ValueError("The database has no tables")
+        readers = readers[:len(tables)]
+        # Size by pages when dbstat is compiled in, by row count otherwise
+        try:
+            sizes = dict(readers[0].execute(
+                "SELECT name, count(*) FROM dbstat GROUP BY name").fetchall())
+        except sqlite3.OperationalError:
+            sizes = {t: readers[0].execute(f"SELECT count(*) FROM {t}").fetchone()[0]
+                     for t in tables}
+        tables.sort(key=lambda t: sizes.get(t, 0), reverse=True)
+        
+        jobs = []
+        used = set()
+        for table in tables:
+            stem = re.sub(r'[^\w.-]', '_', table)
+            name, n = stem, 2
+            while name.lower() in used:
+                name, n = f"{stem}_{n}", n + 1
+            used.add(name.lower())
+            jobs.append((table, os.path.join(directory, name + EXPORT_FORMATS[fmt])))
+        
+        idle = queue.Queue()
+        for conn in readers:
+            idle.put(conn)
+        
+        def work(job):
+            conn = idle.get()
+            try:
+                return export_table_file(conn, job[0], job[1], fmt)
+            finally:
+                idle.put(conn)
+        
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(readers)) as pool:
+            entries = sorted(pool.map(work, jobs), key=lambda e: e['table'])
+        elapsed = time.perf_counter() - started
+    
+    manifest = {
+        'database': os.path.basename(db.db_path),
+        'exported_at': datetime.now().isoformat(timespec='seconds'),
+        'format': fmt,
+        'seconds': round(elapsed, 3),
+        'tables': entries,
+    }
+    with open(os.path.join(directory, EXPORT_MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def format_export_manifest(manifest):
+    """Render an export_database() manifest as plain text lines"""
+    lines = [f"{'Table':<24} {'Rows':>10} {'Bytes':>12}  SHA-256"]
+    for entry in manifest['tables']:
+        lines.append(f"{entry['table']:<24} {entry['rows']:>10} {entry['bytes']:>12}  "
+                     f"{entry['sha256'][:16]}")
+    lines.append(f"{len(manifest['tables'])} table(s) in {manifest['seconds']:.2f}s; "
+                 f"manifest: {EXPORT_MANIFEST}")
+    return '\n'.join(lines)
+
+
+# ---------- Delta sync ----------
+SYNC_POLICIES = ('skip', 'local', 'remote')
+SYNC_DIRECTIONS = ('both', 'push', 'pull')
+
+
+def database_id(conn, schema='main', create=False):
+    """Stable identifier of a database file (survives copies and drive letters)"""
+    meta = f"{schema}.{INTERNAL_PREFIX}meta"
+    try:
+        row = conn.execute(f"SELECT value FROM {meta} WHERE key = 'db_id'").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    if row is not None or not create:
+        return row[0] if row else None
+    db_id = uuid.uuid4().hex
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {meta} (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute(f"INSERT OR REPLACE INTO {meta} VALUES ('db_id', ?)", (db_id,))
+    return db_id
+
+
+def _table_columns(conn, schema, table):
+    return [c[1] for c in conn.execute(f"PRAGMA {schema}.table_info({quote_ident(table)})")]
+
+
+def _row_hashes(conn, schema, table, columns, key_columns):
+    """{key: hash} for every row, hashing decompressed values"""
+    key_sql = ', '.join(quote_ident(c) for c in key_columns) if key_columns else 'rowid'
+    hash_sql = ', '.join(f"zdecompress({quote_ident(c)})" for c in columns)
+    hashes = {}
+    cursor = conn.execute(f"SELECT {key_sql}, row_hash({hash_sql}) "
+                          f"FROM {schema}.{quote_ident(table)}")
+    width = len(key_columns) or 1
+    for row in cursor:
+        key = tuple(row[:width])
+        hashes[key] = row[width]
+    return hashes
+
+
+def _load_manifest(conn, peer_id, table, schema='main'):
+    if peer_id is None:
+        return {}
+    try:
+        rows = conn.execute(f"SELECT row_key, hash FROM {schema}.{INTERNAL_PREFIX}sync_manifest "
+                            "WHERE peer = ? AND tbl = ?", (peer_id, table)).fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    return {tuple(json.loads(k)): h for k, h in rows}
+
+
+def _save_manifest(conn, schema, peer_id, table, manifest, stored):
+    """Bring the stored manifest (as loaded by _load_manifest) up to manifest.
+    
+    Only keys whose hash changed are written, so syncing a few rows of a
+    big table costs a few manifest rows, not a rewrite of all of them.
+    """
+    name = f"{schema}.{INTERNAL_PREFIX}sync_manifest"
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {name} (peer TEXT, tbl TEXT, row_key TEXT, "
+                 "hash BLOB, PRIMARY KEY (peer, tbl, row_key))")
+    conn.executemany(f"DELETE FROM {name} WHERE peer = ? AND tbl = ? AND row_key = ?",
+                     ((peer_id, table, json.dumps(list(k))) for k in stored.keys() - manifest.keys()))
+    conn.executemany(f"INSERT INTO {name} VALUES (?, ?, ?, ?) "
+                     "ON CONFLICT (peer, tbl, row_key) DO UPDATE SET hash = excluded.hash",
+                     ((peer_id, table, json.dumps(list(k)), h) for k, h in manifest.items()
+                      if stored.get(k) != h))
+
+
+def _plan_sync(local, remote, base, direction, policy):
+    """Three-way compare of row hashes against the last synced state.
+    
+    Returns {'push': {key: op}, 'pull': {key: op}, 'conflicts': [keys],
+    'skipped': n} where op is 'insert', 'update' or 'delete'. Without a
+    base (first sync) rows found on one side only are inserts.
+    """
+    plan = {'push': {}, 'pull': {}, 'conflicts': [], 'skipped': 0}
+    for key in local.keys() | remote.keys():
+        mine, theirs, last = local.get(key), remote.get(key), base.get(key)
+        if mine == theirs:
+            continue
+        if last is not None and mine == last:
+            side = 'pull'       # only the other copy changed
+        elif last is not None and theirs == last:
+            side = 'push'       # only this copy changed
+        elif last is None and (mine is None or theirs is None):
+            side = 'push' if theirs is None else 'pull'  # new row on one side
+        else:
+            plan['conflicts'].append(key)
+            if policy == 'skip':
+                continue
+            side = 'push' if policy == 'local' else 'pull'
+        if direction != 'both' and side != direction:
+            plan['skipped'] += 1
+            continue
+        source, target = (mine, theirs) if side == 'push' else (theirs, mine)
+        if source is None:
+            plan[side][key] = 'delete'
+        else:
+            plan[side][key] = 'update' if target is not None else 'insert'
+    return plan
+
+
+def _apply_changes(conn, src, dst, table, columns, key_columns, changes):
+    """Copy/delete the rows named in changes ({key: op}) from schema src to dst"""
+    if not changes:
+        return
+    tbl = quote_ident(table)
+    where = ' AND '.join(f"{quote_ident(c)} IS ?" for c in key_columns) if key_columns else 'rowid = ?'
+    width = len(key_columns) or 1
+    
+    deletes = [list(k) for k, op in changes.items() if op == 'delete']
+    if deletes:
+        conn.executemany(f"DELETE FROM {dst}.{tbl} WHERE {where}", deletes)
+    
+    wanted = [list(k) for k, op in changes.items() if op != 'delete']
+    if not wanted:
+        return
+    compressed = compressed_columns(conn, table, schema=dst)
+    cols_sql = ', '.join(quote_ident(c) for c in columns)
+    placeholders = value_placeholders(columns, compressed)
+    # Read only the changed rows: join the source against a temp table of their keys
+    keys_table = f"temp.{INTERNAL_PREFIX}sync_keys"
+    conn.execute(f"DROP TABLE IF EXISTS {keys_table}")
+    conn.execute(f"CREATE TABLE {keys_table} ({', '.join(f'k{i}' for i in range(width))})")
+    try:
+        conn.executemany(f"INSERT INTO {keys_table} VALUES ({', '.join('?' * width)})", wanted)
+        on = (' AND '.join(f"s.{quote_ident(c)} IS k.k{i}" for i, c in enumerate(key_columns))
+              if key_columns else 's.rowid = k.k0')
+        rows = conn.execute(
+            f"SELECT {', '.join('s.' + quote_ident(c) for c in key_columns) if key_columns else 's.rowid'}, "
+            + ', '.join(f"zdecompress(s.{quote_ident(c)})" for c in columns)
+            + f" FROM {keys_table} k JOIN {src}.{tbl} s ON {on}").fetchall()
+    finally:
+        conn.execute(f"DROP TABLE {keys_table}")
+    for row in rows:
+        key = tuple(row[:width])
+        values = list(row[width:])
+        if not key_columns:
+            # An upsert rather than INSERT OR REPLACE: REPLACE's implicit delete
+            # doesn't fire DELETE triggers, which would leave summaries behind
+            conn.execute(f"INSERT INTO {dst}.{tbl} (rowid, {cols_sql}) VALUES (?, {placeholders}) "
+                         f"ON CONFLICT (rowid) DO UPDATE SET "
+                         + ', '.join(f"{quote_ident(c)} = excluded.{quote_ident(c)}" for c in columns),
+                         [key[0]] + values)
+        elif changes[key] == 'update':
+            conn.execute(f"UPDATE {dst}.{tbl} SET "
+                         f"{assignments([quote_ident(c) for c in columns], {quote_ident(c) for c in compressed})} "
+                         f"WHERE {where}", values + list(key))
+        else:
+            conn.execute(f"INSERT INTO {dst}.{tbl} ({cols_sql}) VALUES ({placeholders})", values)
+
+
+def sync_attached(conn, tables=None, key_columns=None, direction='both',
+                  policy='skip', dry_run=False):
+    """Sync tables between main and the database attached as 'peer'.
+    
+    Rows are matched by rowid (or key_columns) and compared by content
+    hash; only inserted, changed and deleted rows are written. A manifest
+    of the hashes both copies agreed on is stored in each database, so the
+    next sync can tell a deletion on one side from an insert on the other.
+    Returns a list of per-table result dicts.
+    """
+    key_columns = list(key_columns or [])
+    local_tables = {r[0] for r in conn.execute(TABLES_SQL.replace('sqlite_master', 'main.sqlite_master'))}
+    peer_tables = {r[0] for r in conn.execute(TABLES_SQL.replace('sqlite_master', 'peer.sqlite_master'))}
+    if tables is None:
+        tables = sorted(local_tables | peer_tables)
+    
+    local_id = database_id(conn, 'main', create=not dry_run)
+    peer_id = database_id(conn, 'peer', create=not dry_run)
+    results = []
+    for table in tables:
+        result = {'table': table, 'created': None, 'conflicts': [], 'skipped': 0,
+                  'push': Counter(), 'pull': Counter()}
+        results.append(result)
+        if table not in local_tables and table not in peer_tables:
+            result['error'] = "no such table"
+            continue
+        # A table missing on one side is created from the other side's schema
+        for missing, source, side in (('peer', 'main', 'push'), ('main', 'peer', 'pull')):
+            present = local_tables if source == 'main' else peer_tables
+            absent = peer_tables if missing == 'peer' else local_tables
+            if table in present and table not in absent:
+                if direction not in ('both', side):
+                    result['error'] = f"missing on the {'remote' if missing == 'peer' else 'local'} side"
+                    break
+                result['created'] = missing
+                if not dry_run:
+                    create_sql = conn.execute(
+                        f"SELECT sql FROM {source}.sqlite_master WHERE type='table' AND name=?",
+                        (table,)).fetchone()[0]
+                    conn.execute(re.sub(r'^\s*CREATE\s+TABLE\s+', f'CREATE TABLE {missing}.',
+                                        create_sql, count=1, flags=re.IGNORECASE))
+        if 'error' in result:
+            continue
+        
+        columns = _table_columns(conn, 'main' if table in local_tables else 'peer', table)
+        if table in local_tables and table in peer_tables:
+            if set(columns) != set(_table_columns(conn, 'peer', table)):
+                result['error'] = "columns differ between the two databases"
+                continue
+        missing_keys = [c for c in key_columns if c not in columns]
+        if missing_keys:
+            result['error'] = f"no key column(s) {', '.join(missing_keys)}"
+            continue
+        
+        local = (_row_hashes(conn, 'main', table, columns, key_columns)
+                 if table in local_tables else {})
+        remote = (_row_hashes(conn, 'peer', table, columns, key_columns)
+                  if table in peer_tables else {})
+        # Manifests are per key scheme: rowid-matched hashes say nothing about key matches
+        manifest_name = table + ('|' + ','.join(key_columns) if key_columns else '')
+        base = _load_manifest(conn, peer_id, manifest_name)
+        plan = _plan_sync(local, remote, base, direction, policy)
+        result['conflicts'] = plan['conflicts']
+        result['skipped'] = plan['skipped']
+        result['push'].update(plan['push'].values())
+        result['pull'].update(plan['pull'].values())
+        if dry_run:
+            continue
+        
+        _apply_changes(conn, 'main', 'peer', table, columns, key_columns, plan['push'])
+        _apply_changes(conn, 'peer', 'main', table, columns, key_columns, plan['pull'])
+        
+        # Remember what both sides now agree on; keep the old base for the rest
+        manifest = dict(base)
+        for key in local.keys() | remote.keys():
+            mine = remote.get(key) if key in plan['pull'] else local.get(key)
+            theirs = local.get(key) if key in plan['push'] else remote.get(key)
+            if mine == theirs:
+                if mine is None:
+                    manifest.pop(key, None)
+                else:
+                    manifest[key] = mine
+        _save_manifest(conn, 'main', peer_id, manifest_name, manifest, base)
+        _save_manifest(conn, 'peer', local_id, manifest_name, manifest,
+                       _load_manifest(conn, local_id, manifest_name, 'peer'))
+    return results
+
+
+def format_sync_results(results, dry_run=False):
+    """Render sync_attached() results as plain text"""
+    lines = ["Dry run - nothing was changed." if dry_run else "Sync complete."]
+    for r in results:
+        if 'error' in r:
+            lines.append(f"  {r['table']}: skipped ({r['error']})")
+            continue
+        parts = []
+        for side, label in (('push', 'to remote'), ('pull', 'to local')):
+            counts = r[side]
+            if counts:
+                parts.append(f"{label}: +{counts['insert']} ~{counts['update']} -{counts['delete']}")
+        if r['created']:
+            parts.insert(0, f"table created on {'remote' if r['created'] == 'peer' else 'local'} side")
+        if r['conflicts']:
+            shown = ', '.join(str(k[0] if len(k) == 1 else k) for k in r['conflicts'][:5])
+            more = '...' if len(r['conflicts']) > 5 else ''
+            parts.append(f"{len(r['conflicts'])} conflict(s) [{shown}{more}]")
+        if r['skipped']:
+            parts.append(f"{r['skipped']} change(s) in the other direction not applied")
+        lines.append(f"  {r['table']}: {'; '.join(parts) if parts else 'in sync'}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------- Materialized summaries ----------
+SUMMARIES_TABLE = f"{INTERNAL_PREFIX}summaries"
+SUMMARY_FUNCTIONS = ('count', 'sum', 'avg')
+_AGGREGATE_TOKEN = re.compile(r'^(count|sum|avg)(?:\((\*|[^()]+)\))?$', re.IGNORECASE)
+
+
+def parse_aggregate(token):
+    """'count' / 'count(*)' / 'count(col)' / 'sum(col)' / 'avg(col)' -> (func, column or None)"""
+    m = _AGGREGATE_TOKEN.match(token.strip())
+    if not m:
+        raise ValueError(f"Unsupported aggregate '{token}'; use count, count(col), sum(col) or avg(col)")
+    func, column = m.group(1).lower(), (m.group(2) or '*').strip()
+    if column == '*':
+        if func != 'count':
+            raise ValueError(f"{func}() needs a column")
+        return func, None
+    return func, column
+
+
+def _summary_plan(conn, table, group_columns, aggregates):
+    """Check the definition against the source table; return the summary's value columns.
+    
+    Each entry is (summary column, kind, source column) with kind 'count'
+    or 'sum'; avg(col) is served by a generated column over the sum and
+    count of col, so only counts and sums ever need maintaining.
+    """
+    source = [c[1] for c in conn.execute(f"PRAGMA table_info({quote_ident(table)})")]
+    if not source:
+        raise ValueError(f"Table not found: {table}")
+    compressed = compressed_columns(conn, table)
+    for column in list(group_columns) + [c for _, c in aggregates if c]:
+        if column not in source:
+            raise ValueError(f"No column '{column}' in {table}")
+        if column in compressed:
+            raise ValueError(f"'{column}' is stored compressed and can't be summarized")
+    values = []
+    for func, column in aggregates:
+        needed = [('count', column)] if func == 'count' else [('sum', column), ('count', column)]
+        for kind, col in needed:
+            name = f"{kind}_{col}" if col else 'count'
+            if name not in [v[0] for v in values]:
+                values.append((name, kind, col))
+    return values
+
+
+def _summary_triggers(name, table, group_columns, values):
+    """CREATE TRIGGER statements that keep summary name in step with table"""
+    s, t = quote_ident(name), quote_ident(table)
+    
+    def match(ref):
+        return ' AND '.join(f"{quote_ident(g)} IS {ref}.{quote_ident(g)}"
+                            for g in group_columns) or '1'
+    
+    def add(ref):
+        sets = ['row_count = row_count + 1']
+        for column, kind, col in values:
+            c = quote_ident(column)
+            if kind == 'count':
+                sets.append(f"{c} = {c} + 1" if col is None
+                            else f"{c} = {c} + ({ref}.{quote_ident(col)} IS NOT NULL)")
+            else:
+                v = f"{ref}.{quote_ident(col)}"
+                sets.append(f"{c} = CASE WHEN {v} IS NULL THEN {c} ELSE COALESCE({c}, 0) + {v} END")
+        groups = ', '.join(quote_ident(g) for g in group_columns)
+        zeros = ', '.join(['0'] + ['0' if kind == 'count' else 'NULL' for _, kind, _ in values])
+        insert_columns = ', '.join(([groups] if groups else []) + ['row_count']
+                                   + [quote_ident(v[0]) for v in values])
+        insert_values = ', '.join([f"{ref}.{quote_ident(g)}" for g in group_columns] + [zeros])
+        return (f"INSERT INTO {s} ({insert_columns}) SELECT {insert_values} "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {s} WHERE {match(ref)}); "
+                f"UPDATE {s} SET {', '.join(sets)} WHERE {match(ref)};")
+    
+    def remove(ref):
+        sets = ['row_count = row_count - 1']
+        for column, kind, col in values:
+            c = quote_ident(column)
+            if kind == 'count':
+                sets.append(f"{c} = {c} - 1" if col is None
+                            else f"{c} = {c} - ({ref}.{quote_ident(col)} IS NOT NULL)")
+            else:
+                v = f"{ref}.{quote_ident(col)}"
+                count = quote_ident(f"count_{col}")
+                sets.append(f"{c} = CASE WHEN {v} IS NULL THEN {c} WHEN {count} = 1 THEN NULL "
+                            f"ELSE {c} - {v} END")
+        return (f"UPDATE {s} SET {', '.join(sets)} WHERE {match(ref)}; "
+                f"DELETE FROM {s} WHERE {match(ref)} AND row_count <= 0;")
+    
+    watched = ', '.join(quote_ident(c) for c in
+                        dict.fromkeys(list(group_columns) + [col for _, _, col in values if col]))
+    prefix = f"{INTERNAL_PREFIX}{name}"
+    triggers = [
+        f"CREATE TRIGGER {quote_ident(prefix + '_ai')} AFTER INSERT ON {t} BEGIN {add('new')} END",
+        f"CREATE TRIGGER {quote_ident(prefix + '_ad')} AFTER DELETE ON {t} BEGIN {remove('old')} END",
+    ]
+    if watched:
+        triggers.append(f"CREATE TRIGGER {quote_ident(prefix + '_au')} AFTER UPDATE OF {watched} "
+                        f"ON {t} BEGIN {remove('old')} {add('new')} END")
+    return triggers
+
+
+def _summary_columns(group_columns, values):
+    groups = [quote_ident(g) for g in group_columns]
+    return ', '.join(groups + ['row_count'] + [quote_ident(v[0]) for v in values])
+
+
+def _summary_select_sql(table, group_columns, values):
+    """The GROUP BY that computes a summary's rows from scratch"""
+    groups = ', '.join(quote_ident(g) for g in group_columns)
+    exprs = ['count(*)']
+    for _, kind, col in values:
+        exprs.append('count(*)' if col is None else f"{kind}({quote_ident(col)})")
+    select = ', '.join(([groups] if groups else []) + exprs)
+    return (f"SELECT {select} FROM {quote_ident(table)}"
+            + (f" GROUP BY {groups}" if groups else ""))
+
+
+def _summary_fill_sql(name, table, group_columns, values):
+    return (f"INSERT INTO {quote_ident(name)} ({_summary_columns(group_columns, values)}) "
+            + _summary_select_sql(table, group_columns, values))
+
+
+def create_summary(conn, name, table, group_columns, aggregates):
+    """Create summary table name holding GROUP BY rollups of table, kept current by triggers.
+    
+    aggregates is a list of (func, column) from parse_aggregate(). The
+    summary gets one row per group with row_count plus count_<col>,
+    sum_<col> and (generated) avg_<col> columns, and an index on the group
+    columns, so reading a rollup is an index lookup instead of a scan of
+    the source table. INSERT/UPDATE/DELETE triggers on the source apply
+    each change to its group only. The rows that INSERT OR REPLACE (or
+    REPLACE) deletes don't fire DELETE triggers unless the connection has
+    PRAGMA recursive_triggers on; check_summary() finds the drift.
+    """
+    if not aggregates:
+        raise ValueError("Give at least one aggregate, e.g. count or sum(amount)")
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone():
+        raise ValueError(f"'{name}' already exists")
+    values = _summary_plan(conn, table, group_columns, aggregates)
+    columns = [quote_ident(g) for g in group_columns] + ['row_count INTEGER NOT NULL']
+    columns += [f"{quote_ident(c)} {'INTEGER NOT NULL' if kind == 'count' else 'NUMERIC'}"
+                for c, kind, _ in values]
+    for func, col in aggregates:
+        if func == 'avg':
+            columns.append(f"{quote_ident('avg_' + col)} REAL GENERATED ALWAYS AS "
+                           f"(1.0 * {quote_ident('sum_' + col)} / NULLIF({quote_ident('count_' + col)}, 0))")
+    conn.execute(f"CREATE TABLE {quote_ident(name)} ({', '.join(dict.fromkeys(columns))})")
+    if group_columns:
+        conn.execute(f"CREATE UNIQUE INDEX {quote_ident(INTERNAL_PREFIX + name + '_groups')} "
+                     f"ON {quote_ident(name)} ({', '.join(quote_ident(g) for g in group_columns)})")
+    conn.execute(_summary_fill_sql(name, table, group_columns, values))
+    for trigger in _summary_triggers(name, table, group_columns, values):
+        conn.execute(trigger)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {SUMMARIES_TABLE} (name TEXT PRIMARY KEY, "
+                 "source_table TEXT NOT NULL, group_columns TEXT NOT NULL, aggregates TEXT NOT NULL)")
+    conn.execute(f"INSERT INTO {SUMMARIES_TABLE} VALUES (?, ?, ?, ?)",
+                 (name, table, json.dumps(list(group_columns)), json.dumps(aggregates)))
+
+
+def list_summaries(conn):
+    """[(name, source table, group columns, aggregates)] of the defined summaries"""
+    try:
+        rows = conn.execute(f"SELECT * FROM {SUMMARIES_TABLE} ORDER BY name").fetchall()
+    except sqlite3.OperationalError:
+        return []
+    return [(r[0], r[1], json.loads(r[2]), [tuple(a) for a in json.loads(r[3])]) for r in rows]
+
+
+def rebuild_summary(conn, name):
+    """Recompute a summary from its source table; returns its number of groups.
+    
+    Fixes drift, e.g. float rounding in sums or rows changed while the
+    triggers were missing (a restored backup, an external tool).
+    """
+    for summary, table, group_columns, aggregates in list_summaries(conn):
+        if summary == name:
+            values = _summary_plan(conn, table, group_columns, aggregates)
+            conn.execute(f"DELETE FROM {quote_ident(name)}")
+            conn.execute(_summary_fill_sql(name, table, group_columns, values))
+            return conn.execute(f"SELECT count(*) FROM {quote_ident(name)}").fetchone()[0]
+    raise ValueError(f"No summary named '{name}'")
+
+
+def check_summary(conn, name):
+    """Compare a summary with a fresh GROUP BY of its source table.
+    
+    Returns (number of groups, [(group, stored values, fresh values)]) for
+    the groups that differ; a group missing on one side has None there.
+    Sums are compared with a small tolerance for float rounding.
+    """
+    for summary, table, group_columns, aggregates in list_summaries(conn):
+        if summary == name:
+            values = _summary_plan(conn, table, group_columns, aggregates)
+            width = len(group_columns)
+            stored_sql = f"SELECT {_summary_columns(group_columns, values)} FROM {quote_ident(name)}"
+            fresh_sql = _summary_select_sql(table, group_columns, values)
+            stored = {tuple(r[:width]): tuple(r[width:]) for r in conn.execute(stored_sql)}
+            fresh = {tuple(r[:width]): tuple(r[width:]) for r in conn.execute(fresh_sql)}
+            
+            def same(a, b):
+                return a == b or (a is not None and b is not None
+                                  and math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9))
+            
+            diffs = []
+            for group in dict.fromkeys(list(fresh) + list(stored)):
+                a, b = stored.get(group), fresh.get(group)
+                if a is None or b is None or not all(map(same, a, b)):
+                    diffs.append((group, a, b))
+            return len(fresh), diffs
+    raise ValueError(f"No summary named '{name}'")
+
+
+def drop_summary(conn, name):
+    """Remove a summary table, its triggers and its definition"""
+    if name not in [s[0] for s in list_summaries(conn)]:
+        raise ValueError(f"No summary named '{name}'")
+    for suffix in ('_ai', '_ad', '_au'):
+        conn.execute(f"DROP TRIGGER IF EXISTS {quote_ident(INTERNAL_PREFIX + name + suffix)}")
+    conn.execute(f"DROP TABLE IF EXISTS {quote_ident(name)}")
+    conn.execute(f"DELETE FROM {SUMMARIES_TABLE} WHERE name = ?", (name,))
+
+
+# ---------- Query plans ----------
+# Progress-handler granularity used to count VM steps during 'explain --run'
+EXPLAIN_STEP_INTERVAL = 100
+_SCAN_DETAIL = re.compile(r'^SCAN (?:TABLE )?("[^"]+"|\S+)(?: USING (COVERING )?INDEX (\S+))?')
+
+
+def plan_flags(detail):
+    """Warnings for one EXPLAIN QUERY PLAN step"""
+    flags = []
+    scan = _SCAN_DETAIL.match(detail)
+    if scan and not detail.startswith(('SCAN CONSTANT ROW', 'SCAN (subquery')):
+        flags.append('full index scan' if scan.group(3) else 'full table scan')
+    if 'TEMP B-TREE' in detail:
+        flags.append('temp b-tree')
+    if 'AUTOMATIC' in detail:
+        flags.append('automatic index')
+    if detail.startswith('CORRELATED'):
+        flags.append('runs once per outer row')
+    return flags
+
+
+def query_plan(conn, sql, params=()):
+    """EXPLAIN QUERY PLAN as a list of (depth, detail, flags) in tree order"""
+    children = {}
+    for node_id, parent, _, detail in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+        children.setdefault(parent, []).append((node_id, detail))
+    plan = []
+    
+    def walk(parent, depth):
+        for node_id, detail in children.get(parent, ()):
+            plan.append((depth, detail, plan_flags(detail)))
+            walk(node_id, depth + 1)
+    
+    walk(0, 0)
+    return plan
+
+
+def explain_query(conn, sql, params=(), run=False):
+    """Query plan of sql, optionally with the cost of actually running it.
+    
+    With run=True the (read-only) query is executed and fully fetched, and
+    the result adds wall time, rows returned and VM steps. The steps are
+    counted by a progress handler every EXPLAIN_STEP_INTERVAL instructions,
+    as Python's sqlite3 has no sqlite3_stmt_status().
+    """
+    result = {'sql': sql, 'plan': query_plan(conn, sql, params), 'run': None}
+    if not run:
+        return result
+    if not is_read_query(sql):
+        raise ValueError("Only read queries can be run by explain; the plan alone is safe for writes")
+    steps = [0]
+    
+    def tick():
+        steps[0] += 1
+        return 0
+    
+    returned = 0
+    conn.set_progress_handler(tick, EXPLAIN_STEP_INTERVAL)
+    try:
+        started = time.perf_counter()
+        cursor = conn.execute(sql, params)
+        while True:
+            batch = cursor.fetchmany(1000)
+            if not batch:
+                break
+            returned += len(batch)
+        seconds = time.perf_counter() - started
+    finally:
+        conn.set_progress_handler(None, 0)
+    result['run'] = {
+        'seconds': seconds,
+        'rows_returned': returned,
+        'vm_steps': steps[0] * EXPLAIN_STEP_INTERVAL,
+    }
+    return result
+
+
+def format_query_plan(result):
+    """Render an explain_query() result as a tree like the sqlite3 shell's .eqp output"""
+    plan = result['plan']
+    
+    def continues(i, depth):
+        """True if another step at this depth follows before its branch ends"""
+        for d, _, _ in plan[i + 1:]:
+            if d <= depth:
+                return d == depth
+        return False
+    
+    lines = ["QUERY PLAN"]
+    for i, (depth, detail, flags) in enumerate(plan):
+        prefix = "".join("|  " if continues(i, level) else "   " for level in range(depth))
+        line = f"{prefix}{'|--' if continues(i, depth) else '`--'}{detail}"
+        if flags:
+            line = f"{line:<60} <- {', '.join(flags)}"
+        lines.append(line)
+    if not any(flags for _, _, flags in plan):
+        lines.append("No full scans, temp b-trees or automatic indexes.")
+    run = result['run']
+    if run:
+        lines.append("")
+        steps = f"~{run['vm_steps']:,}" if run['vm_steps'] else f"<{EXPLAIN_STEP_INTERVAL}"
+        lines.append(f"Ran in {run['seconds'] * 1000:.1f} ms: {run['rows_returned']:,} rows returned, "
+                     f"{steps} VM steps")
+    return "\n".join(lines)
+
+
+# ---------- Maintenance ----------
+def fragmentation_report(conn, db_path, scan_pages=True):
+    """Free-page and fragmentation figures for the database file.
+    
+    Fragmentation is the share of b-tree pages that do not directly follow
+    the previous page of the same table/index in traversal order; it needs
+    the dbstat virtual table and reads every page, so it can be skipped.
+    """
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    wal_path = db_path + '-wal'
+    report = {
+        'page_size': page_size,
+        'page_count': page_count,
+        'free_pages': free_pages,
+        'free_percent': 100 * free_pages / page_count if page_count else 0.0,
+        'auto_vacuum': {0: 'none', 1: 'full', 2: 'incremental'}.get(auto_vacuum, str(auto_vacuum)),
+        'wal_bytes': os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+        'fragmentation_percent': None,
+        'most_fragmented': [],
+    }
+    if not scan_pages:
+        return report
+    
+    try:
+        cursor = conn.execute("SELECT name, pageno FROM dbstat")
+    except sqlite3.OperationalError:
+        return report  # SQLite built without dbstat
+    pages = Counter()
+    jumps = Counter()
+    last_page = {}
+    for name, pageno in cursor:
+        if name in last_page and pageno != last_page[name] + 1:
+            jumps[name] += 1
+        last_page[name] = pageno
+        pages[name] += 1
+    total_pages = sum(pages.values())
+    if total_pages:
+        report['fragmentation_percent'] = 100 * sum(jumps.values()) / total_pages
+        report['most_fragmented'] = [
+            (name, 100 * jumps[name] / pages[name], pages[name])
+            for name in sorted(jumps, key=lambda n: jumps[n] / pages[n], reverse=True)[:3]
+        ]
+    return report
+
+
+def format_fragmentation(report):
+    """Render a fragmentation_report() result as plain text lines"""
+    free_kb = report['free_pages'] * report['page_size'] / 1024
+    lines = [
+        f"Pages: {report['page_count']} x {report['page_size']} bytes",
+        f"Free pages: {report['free_pages']} ({report['free_percent']:.1f}%, {free_kb:.0f} KB reclaimable)",
+        f"Auto-vacuum: {report['auto_vacuum']}",
+        f"WAL file: {report['wal_bytes'] / 1024:.0f} KB",
+    ]
+    if report['fragmentation_percent'] is None:
+        lines.append("Fragmentation: not measured")
+    else:
+        lines.append(f"Fragmentation: {report['fragmentation_percent']:.1f}% of pages out of order")
+        for name, percent, pages in report['most_fragmented']:
+            lines.append(f"  {name}: {percent:.1f}% of {pages} pages")
+    return lines
+
+
+# ---------- Column profiling ----------
+def _sqlite_sort_key(value):
+    """Order values the way SQLite does: NULL < numbers < text < blobs"""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, bytes(value))
+
+
+def _as_number(value):
+    """Return value as a finite float if it is (or looks like) a number, else None"""
+    if isinstance(value, (int, float)):
+        number = float(value)
+    elif isinstance(value, str):
+        try:
+            number = float(value)
+        except ValueError:
+            return None
+    else:
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _column_stats(counter, top_n, bins):
+    """Summarise a Counter of value -> occurrences for one column"""
+    nulls = counter.pop(None, 0)
+    stats = {
+        'nulls': nulls,
+        'distinct': len(counter),
+        'min': min(counter, key=_sqlite_sort_key) if counter else None,
+        'max': max(counter, key=_sqlite_sort_key) if counter else None,
+        'top': counter.most_common(top_n),
+        'histogram': None,
+    }
+    
+    # Histogram only for columns whose every value is numeric (CSV imports
+    # store numbers as TEXT, so numeric-looking strings count too)
+    numbers = []
+    for value, count in counter.items():
+        number = _as_number(value)
+        if number is None:
+            return stats
+        numbers.append((number, count))
+    if not numbers:
+        return stats
+    low = min(n for n, _ in numbers)
+    high = max(n for n, _ in numbers)
+    width = (high - low) / bins or 1
+    counts = [0] * bins
+    for number, count in numbers:
+        counts[min(int((number - low) / width), bins - 1)] += count
+    stats['histogram'] = [(low + i * width, low + (i + 1) * width, c) for i, c in enumerate(counts)]
+    return stats
+
+
+def profile_table(conn, table, top_n=5, bins=10, group_size=8):
+    """Compute per-column stats for a table.
+    
+    Columns are processed in groups; each group costs one sequential scan,
+    and every statistic for those columns comes out of that single pass.
+    """
+    columns = [c[1] for c in conn.execute(f"PRAGMA table_info({quote_ident(table)})").fetchall()]
+    if not columns:
+        raise ValueError(f"Table not found: {table}")
+    
+    row_count = 0
+    stats = {}
+    for start in range(0, len(columns), group_size):
+        group = columns[start:start + group_size]
+        counters = [Counter() for _ in group]
+        compressed = compressed_columns(conn, table)
+        cursor = conn.execute("SELECT " + ', '.join(
+            f"zdecompress({quote_ident(c)})" if c in compressed else quote_ident(c) for c in group
+        ) + f" FROM {quote_ident(table)}")
+        group_rows = 0
+        while True:
+            batch = cursor.fetchmany(1000)
+            if not batch:
+                break
+            group_rows += len(batch)
+            for row in batch:
+                for counter, value in zip(counters, row):
+                    counter[value] += 1
+        row_count = group_rows
+        for name, counter in zip(group, counters):
+            stats[name] = _column_stats(counter, top_n, bins)
+    return {'table': table, 'rows': row_count, 'columns': stats}
+
+
+def format_profile(profile, width=40):
+    """Render a profile_table() result as plain text"""
+    def short(value):
+        text = repr(value) if isinstance(value, (bytes, bytearray)) else str(value)
+        return text if len(text) <= width else text[:width - 3] + '...'
+    
+    lines = [f"Profile of {profile['table']} ({profile['rows']} rows)"]
+    for name, st in profile['columns'].items():
+        lines.append("")
+        lines.append(f"{name}")
+        lines.append(f"  nulls: {st['nulls']}  distinct: {st['distinct']}")
+        lines.append(f"  min: {short(st['min'])}")
+        lines.append(f"  max: {short(st['max'])}")
+        if st['top']:
+            lines.append("  top values:")
+            for value, count in st['top']:
+                lines.append(f"    {short(value)}  ({count})")
+        if st['histogram']:
+            peak = max(c for _, _, c in st['histogram']) or 1
+            lines.append("  histogram:")
+            for low, high, count in st['histogram']:
+                bar = '#' * round(20 * count / peak)
+                lines.append(f"    {low:>10.4g} - {high:<10.4g} {bar} {count}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------- Command profiler ----------
+# Terminal commands that 'profile <command ...>' can wrap (anything else is a table name)
+TERMINAL_COMMANDS = ('tables', 'use', 'schema', 'select', 'insert', 'update', 'delete', 'sql',
+                     'explain', 'export', 'import', 'backup', 'info', 'profile', 'cache', 'begin',
+                     'commit', 'rollback', 'source', 'maintain', 'compress', 'sync', 'save',
+                     'summary', 'rebuild')
+
+
+def run_profiled(func, dump_path=None):
+    """Run func() under cProfile; returns (result, error, stats, seconds).
+    
+    Exceptions from func are returned rather than raised so the profile of
+    a failing command can still be shown. With dump_path the raw profile is
+    also written there as a .prof file (open it with pstats or snakeviz).
+    """
+    profiler = cProfile.Profile()
+    result = error = None
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        result = func()
+    except Exception as e:
+        error = e
+    finally:
+        profiler.disable()
+    seconds = time.perf_counter() - started
+    if dump_path:
+        profiler.dump_stats(dump_path)
+    return result, error, pstats.Stats(profiler), seconds
+
+
+def _phase_of(funcname):
+    """Which phase a builtin's own time belongs to: 'sql', 'tk' or None"""
+    if 'sqlite3.' in funcname:
+        return 'sql'
+    if '_tkinter' in funcname:
+        return 'tk'
+    return None
+
+
+def format_hotspots(label, stats, seconds, top_n=15, dump_path=None):
+    """Summarize a run_profiled() result: SQL / Tk / Python split and top functions.
+    
+    The split uses the functions' own time: the C methods of sqlite3
+    connections and cursors count as SQL (so Python SQL functions such as
+    zdecompress stay under Python), those of the Tcl interpreter as Tk, and
+    everything else as Python.
+    """
+    entries = stats.stats
+    phases = {'sql': 0.0, 'tk': 0.0}
+    for (filename, lineno, funcname), (_, _, tottime, _, _) in entries.items():
+        phase = _phase_of(funcname) if filename == '~' else None
+        if phase:
+            phases[phase] += tottime
+    python = max(seconds - phases['sql'] - phases['tk'], 0.0)
+    
+    def share(part):
+        return f"{part * 1000:9.1f} ms  {100 * part / seconds if seconds else 0:5.1f}%"
+    
+    lines = [f"Profile of '{label}': {seconds * 1000:.1f} ms",
+             f"  SQLite   {share(phases['sql'])}",
+             f"  Tk       {share(phases['tk'])}",
+             f"  Python   {share(python)}",
+             "",
+             f"Top {top_n} by own time:",
+             f"{'calls':>8} {'own ms':>9} {'total ms':>9}  function"]
+    hottest = sorted(entries.items(), key=lambda item: item[1][2], reverse=True)[:top_n]
+    for (filename, lineno, funcname), (_, ncalls, tottime, cumtime, _) in hottest:
+        where = funcname if filename == '~' else f"{os.path.basename(filename)}:{lineno}({funcname})"
+        lines.append(f"{ncalls:>8} {tottime * 1000:>9.2f} {cumtime * 1000:>9.2f}  {where}")
+    if dump_path:
+        lines.append(f"Full profile saved to {dump_path}")
+    return "\n".join(lines) + "\n"
+
+
+def profiled_action(method):
+    """Let the Tools > Profile Next Action toggle wrap this GUI action in cProfile"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._profile_next_action is None or not self._profile_next_action.get():
+            return method(self, *args, **kwargs)
+        # Switch off first so nested actions (e.g. load_table_data) run normally
+        self._profile_next_action.set(False)
+        return self.profile_call(method.__name__, lambda: method(self, *args, **kwargs))
+    return wrapper
+
 
 class PortableDatabase:
     def __init__(self):
@@ -40,10 +2695,35 @@ class PortableDatabase:
         self.db_path = os.path.join(self.base_dir, "portable_data.db")
         self.config_path = os.path.join(self.base_dir, "config.json")
         
+        self.db = None
         self.conn = None
         self.current_table = None
         self.is_locked = True
         
+        # Last seen PRAGMA data_version / schema_version (external change watcher)
+        self._data_version = None
+        self._schema_version = None
+        
+        # Column profiles: table -> (data_version, profile), plus jobs in flight
+        self._profile_cache = {}
+        self._profile_jobs = {}
+        self._profile_results = queue.Queue()
+        self.query_cache = None
+        
+        # Terminal 'begin' ... 'commit': changes at begin, grid refresh owed
+        self._tx_start_changes = 0
+        self._grid_stale = False
+        
+        # Idle maintenance: last keyboard/mouse activity and last PRAGMA optimize
+        self._last_activity = time.time()
+        self._last_optimize = 0
+        
+        # Write-behind: a flush of queued record edits is already scheduled
+        self._flush_scheduled = False
+        
+        # Tools > Profile Next Action (a BooleanVar once the GUI exists)
+        self._profile_next_action = None
+        
         # Load or create config
         self.load_config()
         
@@ -57,19 +2737,15 @@ class PortableDatabase:
         self.init_database()
         self.create_gui()
         self.refresh_tables_list()
+        self.start_change_watcher()
+        self.start_maintenance_scheduler()
+        self.start_write_back_timer()
         
     def load_config(self):
         """Load configuration from JSON file"""
-        if os.path.exists(self.config_path):
-            with open(self.config_path, 'r') as f:
-                self.config = json.load(f)
-        else:
-            self.config = {
-                'password_enabled': False,
-                'password_hash': None,
-                'auto_backup': True,
-                'theme': 'default'
-            }
+        exists = os.path.exists(self.config_path)
+        self.config = read_config(self.config_path)
+        if not exists:
             self.save_config()
     
     def save_config(self):
@@ -93,9 +2769,33 @@ class PortableDatabase:
             return False
     
     def init_database(self):
-        """Initialize database connection"""
-        self.conn = sqlite3.connect(self.db_path)
-        self.conn.row_factory = sqlite3.Row
+        """Initialize database connections (WAL writer + read-only pool)"""
+        self.db = ConnectionManager.from_config(self.db_path, self.config)
+        self.conn = self.db.writer
+        self.query_cache = QueryCache(int(self.config.get('query_cache_mb', 32) * 1048576))
+    
+    def cached_query(self, sql, params=()):
+        """Run a read query, answering repeats from the result cache.
+        
+        Returns (columns, rows). Inside an open transaction, or for queries
+        whose result can change without a write (random(), 'now', ...), the
+        cache is bypassed.
+        """
+        use_cache = (self.query_cache.max_bytes > 0 and not self.conn.in_transaction
+                     and QueryCache.cacheable(sql))
+        if use_cache:
+            key = QueryCache.make_key(sql, params)
+            version = self.db.data_version()
+            hit = self.query_cache.get(key, version)
+            if hit is not None:
+                return hit
+        with self.db.reader() as conn:
+            cursor = conn.execute(sql, params)
+            rows = cursor.fetchall()
+            columns = [d[0] for d in cursor.description]
+        if use_cache:
+            self.query_cache.put(key, version, columns, rows)
+        return columns, rows
         
     def create_gui(self):
         """Create the main GUI interface"""
@@ -104,6 +2804,8 @@ class PortableDatabase:
         style.theme_use('clam')
         
         # Top menu bar
+        self._profile_next_action = tk.BooleanVar(value=False)
+        
         menubar = tk.Menu(self.root)
         self.root.config(menu=menubar)
         
@@ -113,11 +2815,18 @@ class PortableDatabase:
         file_menu.add_command(label="New Table", command=self.create_table_dialog)
         file_menu.add_command(label="Import CSV", command=self.import_csv)
         file_menu.add_command(label="Import JSON", command=self.import_json)
+        file_menu.add_command(label="Import Excel", command=self.import_xlsx)
+        file_menu.add_command(label="Import Snapshot", command=self.import_snapshot)
         file_menu.add_separator()
         file_menu.add_command(label="Export Table (CSV)", command=self.export_csv)
         file_menu.add_command(label="Export Table (JSON)", command=self.export_json)
+        file_menu.add_command(label="Export Table (Excel)", command=self.export_xlsx)
+        file_menu.add_command(label="Export Table (Snapshot)", command=self.export_snapshot)
+        file_menu.add_command(label="Export All Tables...", command=self.export_all_dialog)
         file_menu.add_separator()
+        file_menu.add_command(label="Save to Disk", command=self.save_to_disk)
         file_menu.add_command(label="Backup Database", command=self.backup_database)
+        file_menu.add_command(label="Sync With Database...", command=self.sync_dialog)
         file_menu.add_command(label="Restore Database", command=self.restore_database)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.root.quit)
@@ -128,6 +2837,11 @@ class PortableDatabase:
         tools_menu.add_command(label="SQL Query", command=self.sql_query_dialog)
         tools_menu.add_command(label="Set Password", command=self.set_password_dialog)
         tools_menu.add_command(label="Database Info", command=self.show_db_info)
+        tools_menu.add_command(label="Column Profile", command=self.toggle_profile_panel)
+        tools_menu.add_command(label="Compress Column...", command=self.compress_column_dialog)
+        tools_menu.add_command(label="New Summary Table...", command=self.summary_dialog)
+        tools_menu.add_command(label="Rebuild Summaries", command=self.rebuild_summaries)
+        tools_menu.add_checkbutton(label="Profile Next Action", variable=self._profile_next_action)
         tools_menu.add_separator()
         tools_menu.add_command(label="Open Terminal", command=self.toggle_terminal)
         
@@ -170,6 +2884,19 @@ class PortableDatabase:
         ttk.Button(toolbar, text="✏️ Edit Record", command=self.edit_record_dialog).pack(side=tk.LEFT, padx=5)
         ttk.Button(toolbar, text="🗑️ Delete Record", command=self.delete_record).pack(side=tk.LEFT, padx=5)
         ttk.Button(toolbar, text="🔄 Refresh", command=self.refresh_data).pack(side=tk.LEFT, padx=5)
+        ttk.Button(toolbar, text="📊 Profile", command=self.toggle_profile_panel).pack(side=tk.LEFT, padx=5)
+        
+        # Column profile side panel (hidden by default)
+        self.profile_visible = False
+        self.profile_frame = ttk.Frame(main_frame, width=300)
+        ttk.Label(self.profile_frame, text="Column Profile", font=('Arial', 11, 'bold')).pack(anchor='w', pady=(0, 5))
+        profile_scrollbar = ttk.Scrollbar(self.profile_frame, orient=tk.VERTICAL)
+        self.profile_text = tk.Text(self.profile_frame, width=40, wrap='none',
+                                    yscrollcommand=profile_scrollbar.set)
+        profile_scrollbar.config(command=self.profile_text.yview)
+        profile_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.profile_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.profile_text.configure(state='disabled')
         
         # Search bar
         search_frame = ttk.Frame(toolbar)
@@ -218,10 +2945,14 @@ class PortableDatabase:
         self.terminal_input.bind('<Return>', self.on_terminal_enter)
         self.write_output("Type 'help' for commands. Current table: none\n")
         
-        # Status bar
-        self.status_bar = ttk.Label(self.root, text="Ready | Database: portable_data.db", 
+        # Status bar (with the write-behind pending-changes indicator on the right)
+        status_frame = ttk.Frame(self.root)
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        self.pending_label = ttk.Label(status_frame, text="", relief=tk.SUNKEN, anchor=tk.E)
+        self.pending_label.pack(side=tk.RIGHT)
+        self.status_bar = ttk.Label(status_frame, text="Ready | Database: portable_data.db", 
                                     relief=tk.SUNKEN, anchor=tk.W)
-        self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
 
     # ---------- Terminal UI & Commands ----------
     def toggle_terminal(self):
@@ -276,6 +3007,8 @@ class PortableDatabase:
             self._cmd_delete(args)
         elif cmd == "sql":
             self._cmd_sql(args)
+        elif cmd == "explain":
+            self._cmd_explain(args)
         elif cmd == "export":
             self._cmd_export(args)
         elif cmd == "import":
@@ -285,6 +3018,26 @@ class PortableDatabase:
             self.write_output("Backup created.\n")
         elif cmd == "info":
             self._cmd_info()
+        elif cmd == "profile":
+            self._cmd_profile(args)
+        elif cmd == "cache":
+            self._cmd_cache(args)
+        elif cmd in ("begin", "commit", "rollback"):
+            self._cmd_transaction(cmd)
+        elif cmd == "source":
+            self._cmd_source(args)
+        elif cmd == "maintain":
+            self._cmd_maintain(args)
+        elif cmd == "compress":
+            self._cmd_compress(args)
+        elif cmd == "sync":
+            self._cmd_sync(args)
+        elif cmd == "save":
+            self._cmd_save()
+        elif cmd == "summary":
+            self._cmd_summary(args)
+        elif cmd == "rebuild":
+            self._cmd_rebuild(args)
         elif cmd == "clear":
             self.terminal_text.configure(state='normal')
             self.terminal_text.delete('1.0', tk.END)
@@ -305,10 +3058,44 @@ Commands:
   update id=<rowid> key=val Update row in current table
   delete id=<rowid>         Delete row in current table
   sql <query>               Run raw SQL
+  explain [--run] <query>   Show the query plan as a tree, flagging full scans,
+                            temp b-trees and automatic indexes; --run also
+                            executes it and reports time, VM steps and rows
   export csv <path> [table] Export table as CSV
   export json <path> [table] Export table as JSON
+  export xlsx <path> [table] Export table as Excel (streams, splits big tables)
+  export snapshot <path> [table]
+                            Export table as a compact columnar snapshot (.pdbc)
+  export all <dir> [csv|json|ndjson|snapshot]
+                            Export every table in parallel + manifest
+  import (csv|json|xlsx|snapshot) <path> <table> [mode] [--sheet NAME | --all-sheets]
+                            Import a file; mode: append (default),
+                            skip-duplicates [on col,...] or upsert on col,...
   backup                    Create database backup
   info                      Summary info
+  profile [table]           Column stats (nulls, distinct, min/max, top, histogram)
+  profile [--dump] <command ...>
+                            Run a command under cProfile: SQLite/Tk/Python time
+                            and top hotspots (--dump also saves a .prof file)
+  cache [clear]             Query cache hit/miss stats (or empty the cache)
+  begin                     Start a transaction (defers commits and grid refresh)
+  commit | rollback         End the transaction started by 'begin'
+  source <file.sql>         Run a SQL script in one transaction
+  maintain [report|convert] Optimize + reclaim free pages now, show the
+                            fragmentation report, or enable incremental vacuum
+  compress <table> [column [off]]
+                            Store a text column zlib-compressed (or show status)
+  sync <other.db> [table ...] [--key col,...] [--policy skip|local|remote]
+       [--push|--pull] [--dry-run]
+                            Exchange only changed rows with another copy
+  save                      Write the in-memory database back to its file
+  summary create <name> <table> [by col,...] <agg> ...
+                            Materialized rollup kept current by triggers;
+                            agg: count, count(col), sum(col), avg(col)
+  summary list | summary drop <name>
+                            Show or remove summary tables
+  summary check [name]      Compare summaries with a fresh GROUP BY
+  rebuild [name]            Recompute one summary table (or all) from scratch
   clear                     Clear terminal output
 
 Notes:
@@ -319,7 +3106,7 @@ Notes:
 
     def _cmd_tables(self):
         cursor = self.conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
+        cursor.execute(TABLES_SQL)
         rows = [r[0] for r in cursor.fetchall()]
         if rows:
             self.write_output("Tables:\n" + "\n".join(f"  - {r}" for r in rows) + "\n")
@@ -379,14 +3166,11 @@ Notes:
         if not table:
             self.write_output("Usage: select [table] [limit N]\n")
             return
-        cursor = self.conn.cursor()
         try:
-            sql = f"SELECT rowid, * FROM {table}"
+            sql = f"SELECT {select_list(self.conn, table, with_rowid=True)} FROM {table}"
             if limit is not None:
                 sql += f" LIMIT {limit}"
-            cursor.execute(sql)
-            rows = cursor.fetchall()
-            cols = [d[0] for d in cursor.description]
+            cols, rows = self.cached_query(sql)
             self.write_output("\t".join(cols) + "\n")
             for r in rows:
                 self.write_output("\t".join(str(v) for v in r) + "\n")
@@ -409,11 +3193,10 @@ Notes:
         try:
             data = self._parse_kv_pairs(args)
             cols = ', '.join(data.keys())
-            placeholders = ', '.join(['?' for _ in data])
+            placeholders = value_placeholders(data, compressed_columns(self.conn, self.current_table))
             sql = f"INSERT INTO {self.current_table} ({cols}) VALUES ({placeholders})"
-            self.conn.execute(sql, list(data.values()))
-            self.conn.commit()
-            self.load_table_data()
+            self.db.write(sql, list(data.values()))
+            self._refresh_after_write()
             self.write_output("Inserted 1 row.\n")
         except Exception as e:
             self.write_output(f"Error: {e}\n")
@@ -436,11 +3219,10 @@ Notes:
                 return
             rowid = id_pair.split('=', 1)[1]
             data = self._parse_kv_pairs(rest)
-            set_clause = ', '.join([f"{k}=?" for k in data])
+            set_clause = assignments(data, compressed_columns(self.conn, self.current_table))
             sql = f"UPDATE {self.current_table} SET {set_clause} WHERE rowid=?"
-            cur = self.conn.execute(sql, list(data.values()) + [rowid])
-            self.conn.commit()
-            self.load_table_data()
+            cur = self.db.write(sql, list(data.values()) + [rowid])
+            self._refresh_after_write()
             self.write_output(f"Updated {cur.rowcount} row(s).\n")
         except Exception as e:
             self.write_output(f"Error: {e}\n")
@@ -459,9 +3241,8 @@ Notes:
                 self.write_output("Usage: delete id=<rowid>\n")
                 return
             rowid = id_pair.split('=', 1)[1]
-            cur = self.conn.execute(f"DELETE FROM {self.current_table} WHERE rowid=?", (rowid,))
-            self.conn.commit()
-            self.load_table_data()
+            cur = self.db.write(f"DELETE FROM {self.current_table} WHERE rowid=?", (rowid,))
+            self._refresh_after_write()
             self.write_output(f"Deleted {cur.rowcount} row(s).\n")
         except Exception as e:
             self.write_output(f"Error: {e}\n")
@@ -472,26 +3253,53 @@ Notes:
             return
         query = ' '.join(args)
         try:
-            cur = self.conn.cursor()
-            cur.execute(query)
             if query.strip().upper().startswith('SELECT'):
-                rows = cur.fetchall()
-                cols = [d[0] for d in cur.description]
+                cols, rows = self.cached_query(query)
                 self.write_output("\t".join(cols) + "\n")
                 for r in rows:
                     self.write_output("\t".join(str(v) for v in r) + "\n")
             else:
-                self.conn.commit()
+                cur = self.db.write(query)
                 self.write_output(f"OK. Rows affected: {cur.rowcount}\n")
                 self.refresh_tables_list()
-                if self.current_table:
-                    self.load_table_data()
+                self._refresh_after_write()
         except Exception as e:
             self.write_output(f"Error: {e}\n")
 
+    def _cmd_explain(self, args):
+        run = bool(args) and args[0] == '--run'
+        query = ' '.join(args[1:] if run else args)
+        # Accept a pasted "EXPLAIN QUERY PLAN ..." prefix too
+        query = re.sub(r'^\s*(EXPLAIN\s+)?QUERY\s+PLAN\s+', '', query, flags=re.IGNORECASE)
+        if not query:
+            self.write_output("Usage: explain [--run] <query>\n")
+            return
+        try:
+            with self.db.reader() as conn:
+                result = explain_query(conn, query, run=run)
+            self.write_output(format_query_plan(result) + "\n")
+        except Exception as e:
+            self.write_output(f"Error: {e}\n")
+    
     def _cmd_export(self, args):
+        if args and args[0].lower() == 'all':
+            if len(args) < 2 or (len(args) > 2 and args[2].lower() not in EXPORT_FORMATS):
+                self.write_output("Usage: export all <dir> [csv|json|ndjson|snapshot]\n")
+                return
+            fmt = args[2].lower() if len(args) > 2 else 'csv'
+            self.write_output(f"Exporting all tables to {args[1]} ...\n")
+            
+            def done(manifest, error):
+                if error:
+                    self.write_output(f"Error: {error}\n")
+                else:
+                    self.write_output(format_export_manifest(manifest) + "\n")
+            
+            self.export_all(args[1], fmt, done)
+            return
         if len(args) < 2:
-            self.write_output("Usage: export (csv|json) <path> [table]\n")
+            self.write_output("Usage: export (csv|json|xlsx|snapshot) <path> [table]\n"
+                              "       export all <dir> [csv|json|ndjson|snapshot]\n")
             return
         fmt = args[0].lower()
         path = args[1]
@@ -499,11 +3307,27 @@ Notes:
         if not table:
             self.write_output("Specify a table or use 'use <table>' first.\n")
             return
+        if fmt == 'xlsx':
+            try:
+                count = self.export_xlsx_file(table, path)
+                self.write_output(f"Exported {count} row(s) to Excel file {path}\n")
+            except Exception as e:
+                self.write_output(f"Error: {e}\n")
+            return
+        if fmt == 'snapshot':
+            try:
+                entry = self.export_snapshot_file(table, path)
+                self.write_output(f"Exported {entry['rows']} row(s) to snapshot {path} "
+                                  f"({entry['bytes'] / 1024:.0f} KB)\n")
+            except Exception as e:
+                self.write_output(f"Error: {e}\n")
+            return
         try:
-            cur = self.conn.cursor()
-            cur.execute(f"SELECT * FROM {table}")
-            rows = cur.fetchall()
-            columns = [d[0] for d in cur.description]
+            self.flush_edits()
+            with self.db.reader() as conn:
+                cur = conn.execute(f"SELECT {select_list(conn, table)} FROM {table}")
+                rows = cur.fetchall()
+                columns = [d[0] for d in cur.description]
             if fmt == 'csv':
                 with open(path, 'w', newline='') as f:
                     writer = csv.writer(f)
@@ -516,64 +3340,365 @@ Notes:
                     json.dump(data, f, indent=2)
                 self.write_output(f"Exported JSON to {path}\n")
             else:
-                self.write_output("Format must be 'csv' or 'json'.\n")
+                self.write_output("Format must be 'csv', 'json' or 'xlsx'.\n")
         except Exception as e:
             self.write_output(f"Error: {e}\n")
 
     def _cmd_import(self, args):
+        usage = ("Usage: import (csv|json|xlsx|snapshot) <path> <table> "
+                 "[append | skip-duplicates [on col,...] | upsert on col,...] "
+                 "[--sheet NAME | --all-sheets] [resume | restart]\n")
         if len(args) < 3:
-            self.write_output("Usage: import (csv|json) <path> <table>\n")
+            self.write_output(usage)
             return
         fmt = args[0].lower()
         path = args[1]
         table = args[2]
+        if fmt not in ('csv', 'json', 'xlsx', 'snapshot'):
+            self.write_output("Format must be 'csv', 'json', 'xlsx' or 'snapshot'.\n")
+            return
+        rest = list(args[3:])
+        sheet = None
+        all_sheets = '--all-sheets' in rest
+        if all_sheets:
+            rest.remove('--all-sheets')
+        if '--sheet' in rest:
+            i = rest.index('--sheet')
+            if i + 1 >= len(rest):
+                self.write_output(usage)
+                return
+            sheet = rest[i + 1]
+            del rest[i:i + 2]
+        resume = bool(rest) and rest[-1].lower() == 'resume'
+        restart = bool(rest) and rest[-1].lower() == 'restart'
+        if resume or restart:
+            rest.pop()
+        if (resume or restart) and fmt != 'csv':
+            self.write_output("Only CSV imports are checkpointed and can be resumed.\n")
+            return
         try:
-            if fmt == 'csv':
-                with open(path, 'r') as f:
-                    reader = csv.DictReader(f)
-                    columns = reader.fieldnames
-                    if not columns:
-                        self.write_output("CSV has no header row.\n")
-                        return
-                    columns_def = ', '.join([f"{col} TEXT" for col in columns])
-                    self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns_def})")
-                    for row in reader:
-                        placeholders = ', '.join(['?' for _ in columns])
-                        columns_str = ', '.join(columns)
-                        sql = f"INSERT INTO {table} ({columns_str}) VALUES ({placeholders})"
-                        self.conn.execute(sql, [row.get(col, '') for col in columns])
-                self.conn.commit()
-                self.refresh_tables_list()
-                if self.current_table == table:
-                    self.load_table_data()
-                self.write_output(f"Imported CSV into '{table}'.\n")
-            elif fmt == 'json':
-                with open(path, 'r') as f:
-                    data = json.load(f)
-                if not isinstance(data, list) or not data:
-                    self.write_output("JSON must be a non-empty array of objects.\n")
-                    return
-                columns = list(data[0].keys())
-                columns_def = ', '.join([f"{col} TEXT" for col in columns])
-                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns_def})")
-                for row in data:
-                    placeholders = ', '.join(['?' for _ in columns])
-                    columns_str = ', '.join(columns)
-                    sql = f"INSERT INTO {table} ({columns_str}) VALUES ({placeholders})"
-                    self.conn.execute(sql, [str(row.get(col, '')) for col in columns])
-                self.conn.commit()
-                self.refresh_tables_list()
-                if self.current_table == table:
-                    self.load_table_data()
-                self.write_output(f"Imported JSON into '{table}'.\n")
-            else:
-                self.write_output("Format must be 'csv' or 'json'.\n")
+            mode, key_columns = parse_import_mode(rest)
+            result = self.import_file(fmt, path, table, mode, key_columns, sheet, all_sheets,
+                                      resume, restart)
+            if resume:
+                mode = result['mode']
+                self.write_output(f"Resumed after row {result['resumed_at']}.\n")
+            self.refresh_tables_list()
+            if self.current_table == table:
+                self._refresh_after_write()
+            self.write_output(f"Imported {fmt.upper()} into '{table}': {describe_import(result, mode)}.\n")
         except Exception as e:
             self.write_output(f"Error: {e}\n")
+            saved = fmt == 'csv' and os.path.exists(path) and import_checkpoint(self.conn, path, table)
+            if saved and not isinstance(e, ValueError):
+                self.write_output(f"{saved['rows_read']} row(s) are committed. Run the same "
+                                  "command with 'resume' to continue from there.\n")
 
+    def _cmd_profile(self, args):
+        if args and (args[0] == '--dump' or args[0].lower() in TERMINAL_COMMANDS):
+            dump = args[0] == '--dump'
+            command = shlex.join(args[1:] if dump else args)
+            if not command:
+                self.write_output("Usage: profile [--dump] <command ...>\n")
+                return
+            self.profile_call(' '.join(args[1:] if dump else args),
+                              lambda: self.execute_command(command), dump)
+            return
+        table = args[0] if args else self.current_table
+        if not table:
+            self.write_output("Usage: profile <table>\n")
+            return
+        
+        def show(profile, error):
+            if error:
+                self.write_output(f"Error: {error}\n")
+            else:
+                self.write_output(format_profile(profile))
+        
+        if not self.request_profile(table, show):
+            self.write_output(f"Profiling '{table}' in the background...\n")
+    
+    def _refresh_after_write(self):
+        """Reload the grid after a terminal write, or defer it until commit"""
+        if self.db.explicit_transaction:
+            self._grid_stale = True
+        elif self.current_table:
+            self.load_table_data()
+    
+    def _cmd_transaction(self, cmd):
+        if cmd == "begin":
+            self.db.begin()
+            self._tx_start_changes = self.conn.total_changes
+            self._grid_stale = False
+            self.status_bar.config(text="Transaction open | changes are pending until 'commit'")
+            self.write_output("Transaction started. Use 'commit' or 'rollback' to finish.\n")
+            return
+        changes = self.conn.total_changes - self._tx_start_changes
+        self.db.end(commit=(cmd == "commit"))
+        if cmd == "commit":
+            self.write_output(f"Committed {changes} change(s).\n")
+        else:
+            self.write_output(f"Rolled back {changes} change(s).\n")
+        self.refresh_tables_list()
+        if self.current_table:
+            self.load_table_data()
+        self._grid_stale = False
+    
+    def _split_sql_script(self, script):
+        """Yield (line_number, statement) for each complete statement in a script"""
+        buffer = []
+        start_line = None
+        for number, line in enumerate(script.splitlines(keepends=True), 1):
+            if start_line is None:
+                if not line.strip() or line.lstrip().startswith('--'):
+                    continue
+                start_line = number
+            buffer.append(line)
+            statement = ''.join(buffer)
+            # complete_statement understands quotes and CREATE TRIGGER ... END
+            if sqlite3.complete_statement(statement):
+                yield start_line, statement.strip()
+                buffer = []
+                start_line = None
+        if buffer and ''.join(buffer).strip():
+            yield start_line, ''.join(buffer).strip()
+    
+    def _cmd_source(self, args):
+        if not args:
+            self.write_output("Usage: source <file.sql>\n")
+            return
+        path = args[0]
+        with open(path, 'r') as f:
+            statements = list(self._split_sql_script(f.read()))
+        total = len(statements)
+        if not total:
+            self.write_output("Script is empty.\n")
+            return
+        
+        self.write_output(f"Running {total} statement(s) from {path}...\n")
+        started = time.time()
+        changes_before = self.conn.total_changes
+        self.flush_edits()
+        # A savepoint works both on its own (it opens the transaction) and
+        # nested inside one started with 'begin'
+        with self.db.write_lock:
+            self.conn.execute("SAVEPOINT source_script")
+            for index, (line, statement) in enumerate(statements, 1):
+                try:
+                    self.conn.execute(statement)
+                except Exception as e:
+                    self.conn.execute("ROLLBACK TO source_script")
+                    self.conn.execute("RELEASE source_script")
+                    snippet = ' '.join(statement.split())[:80]
+                    self.write_output(
+                        f"Error in statement {index} of {total} (line {line}): {e}\n"
+                        f"  {snippet}\n"
+                        "Script rolled back; no changes were made.\n")
+                    self.status_bar.config(text=f"Script failed at statement {index}/{total}")
+                    return
+                if index % 100 == 0 or index == total:
+                    self.status_bar.config(text=f"Running script: statement {index}/{total}")
+                    self.root.update_idletasks()
+                if index % 1000 == 0:
+                    self.write_output(f"  {index}/{total} statements...\n")
+            self.conn.execute("RELEASE source_script")
+        
+        changes = self.conn.total_changes - changes_before
+        pending = " (pending until 'commit')" if self.db.explicit_transaction else ""
+        self.write_output(f"Done: {total} statement(s), {changes} row change(s) "
+                          f"in {time.time() - started:.2f}s{pending}.\n")
+        self.refresh_tables_list()
+        self._refresh_after_write()
+    
+    def _cmd_maintain(self, args):
+        sub = args[0].lower() if args else 'run'
+        if sub == 'report':
+            report = fragmentation_report(self.conn, self.db_path)
+            self.write_output("\n".join(format_fragmentation(report)) + "\n")
+        elif sub == 'convert':
+            if self.db.explicit_transaction:
+                self.write_output("Commit or roll back the open transaction first.\n")
+                return
+            self.write_output("Rewriting database with incremental auto-vacuum (full VACUUM)...\n")
+            self.root.update_idletasks()
+            self.flush_edits()
+            with self.db.write_lock:
+                self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                self.conn.execute("VACUUM")
+            self.write_output("Done. Free pages will now be reclaimed while idle.\n")
+        elif sub == 'run':
+            if self.db.explicit_transaction:
+                self.write_output("Commit or roll back the open transaction first.\n")
+                return
+            before = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            started = time.time()
+            while self.run_maintenance_step(budget_ms=None, force_optimize=True):
+                pass
+            after = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            self.write_output(f"Maintenance done in {time.time() - started:.2f}s: "
+                              f"optimized, {before - after} page(s) reclaimed.\n")
+            report = fragmentation_report(self.conn, self.db_path, scan_pages=False)
+            if report['auto_vacuum'] != 'incremental' and report['free_pages']:
+                self.write_output(f"{report['free_pages']} free page(s) can't be reclaimed "
+                                  "incrementally; run 'maintain convert' once.\n")
+        else:
+            self.write_output("Usage: maintain [report|convert]\n")
+    
+    def _cmd_compress(self, args):
+        if not args:
+            self.write_output("Usage: compress <table> [column [off]]\n")
+            return
+        table = args[0]
+        if len(args) == 1:
+            compressed = sorted(compressed_columns(self.conn, table))
+            if not compressed:
+                self.write_output(f"No compressed columns in '{table}'.\n")
+            for column in compressed:
+                stored, raw = self.conn.execute(
+                    f"SELECT COALESCE(SUM(length(CAST({quote_ident(column)} AS BLOB))), 0), "
+                    f"COALESCE(SUM(length(CAST(zdecompress({quote_ident(column)}) AS BLOB))), 0) "
+                    f"FROM {quote_ident(table)}").fetchone()
+                ratio = f"{100 * stored / raw:.0f}%" if raw else "n/a"
+                self.write_output(f"  {column}: {raw / 1024:.1f} KB stored as {stored / 1024:.1f} KB ({ratio})\n")
+            return
+        column = args[1]
+        enabled = not (len(args) > 2 and args[2].lower() == 'off')
+        before, after = self.set_column_compression(table, column, enabled)
+        state = "compressed" if enabled else "stored as plain text"
+        self.write_output(f"{table}.{column} is now {state}: "
+                          f"{before / 1024:.1f} KB -> {after / 1024:.1f} KB\n")
+        self._refresh_after_write()
+    
+    def _cmd_sync(self, args):
+        usage = ("Usage: sync <other.db> [table ...] [--key col,...] "
+                 "[--policy skip|local|remote] [--push|--pull] [--dry-run]\n")
+        path = None
+        tables = []
+        key_columns = None
+        policy = 'skip'
+        direction = 'both'
+        dry_run = False
+        i = 0
+        while i < len(args):
+            tok = args[i]
+            if tok == '--key' and i + 1 < len(args):
+                key_columns = [c.strip() for c in args[i + 1].split(',') if c.strip()]
+                i += 2
+                continue
+            if tok == '--policy' and i + 1 < len(args):
+                policy = args[i + 1].lower()
+                i += 2
+                continue
+            if tok in ('--push', '--pull'):
+                direction = tok[2:]
+            elif tok == '--dry-run':
+                dry_run = True
+            elif tok.startswith('--'):
+                self.write_output(usage)
+                return
+            elif path is None:
+                path = tok
+            else:
+                tables.append(tok)
+            i += 1
+        if path is None or policy not in SYNC_POLICIES:
+            self.write_output(usage)
+            return
+        results = self.sync_with(path, tables or None, key_columns, direction, policy, dry_run)
+        self.write_output(format_sync_results(results, dry_run))
+    
+    def _cmd_summary(self, args):
+        usage = ("Usage: summary create <name> <table> [by col,...] <agg> ... "
+                 "| summary list | summary check [name] | summary drop <name>\n")
+        sub = args[0].lower() if args else 'list'
+        if sub == 'list':
+            summaries = list_summaries(self.conn)
+            if not summaries:
+                self.write_output("No summary tables.\n")
+            for name, table, groups, aggregates in summaries:
+                aggs = ', '.join(f"{f}({c or '*'})" for f, c in aggregates)
+                self.write_output(f"{name}: {aggs} of {table}"
+                                  f"{' by ' + ', '.join(groups) if groups else ''}\n")
+        elif sub == 'check':
+            names = args[1:] or [s[0] for s in list_summaries(self.conn)]
+            if not names:
+                self.write_output("No summary tables.\n")
+            for name in names:
+                groups, diffs = check_summary(self.conn, name)
+                if not diffs:
+                    self.write_output(f"'{name}' matches its table ({groups} group(s)).\n")
+                    continue
+                self.write_output(f"'{name}' differs from its table in {len(diffs)} group(s); "
+                                  f"run 'rebuild {name}' to fix it:\n")
+                for group, stored, fresh in diffs[:10]:
+                    self.write_output(f"  {list(group)}: stored {list(stored) if stored else 'missing'}, "
+                                      f"actual {list(fresh) if fresh else 'none'}\n")
+        elif sub == 'drop' and len(args) == 2:
+            self.db.run_write(lambda conn: drop_summary(conn, args[1]))
+            self.refresh_tables_list()
+            self.write_output(f"Dropped summary '{args[1]}'.\n")
+        elif sub == 'create' and len(args) >= 4:
+            name, table, rest = args[1], args[2], args[3:]
+            groups = []
+            if rest[0].lower() == 'by' and len(rest) > 1:
+                groups = [c for c in rest[1].split(',') if c]
+                rest = rest[2:]
+            self.create_summary(name, table, groups, [parse_aggregate(t) for t in rest])
+            self.write_output(f"Created summary '{name}'; query it like any table.\n")
+        else:
+            self.write_output(usage)
+    
+    def _cmd_rebuild(self, args):
+        names = args or [s[0] for s in list_summaries(self.conn)]
+        if not names:
+            self.write_output("No summary tables.\n")
+        for name in names:
+            groups = self.db.run_write(lambda conn: rebuild_summary(conn, name))
+            self.write_output(f"Rebuilt '{name}': {groups} group(s).\n")
+        if self.current_table in names:
+            self._refresh_after_write()
+    
+    def _cmd_save(self):
+        if not self.db.memory:
+            self.write_output("Not in memory mode; changes are already in the file.\n")
+            return
+        saved = self.db.save()
+        self.write_output(f"Saved to {self.db_path}\n" if saved else "No unsaved changes.\n")
+    
+    def profile_call(self, label, func, dump=None):
+        """Run func under cProfile and print the phase split and hotspots in the terminal"""
+        if dump is None:
+            dump = self.config.get('profiler_dump', False)
+        dump_path = None
+        if dump:
+            dump_path = os.path.join(
+                self.base_dir, f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof")
+        
+        def run():
+            result = func()
+            # Include the redraw the action caused in the Tk share
+            self.root.update_idletasks()
+            return result
+        
+        result, error, stats, seconds = run_profiled(run, dump_path)
+        if not self.terminal_visible:
+            self.toggle_terminal()
+        self.write_output(format_hotspots(label, stats, seconds,
+                                          self.config.get('profiler_top_n', 15), dump_path))
+        if error is not None:
+            raise error
+        return result
+    
+    def _cmd_cache(self, args):
+        if args and args[0].lower() == 'clear':
+            self.query_cache.clear()
+            self.write_output("Query cache cleared.\n")
+            return
+        self.write_output(self.query_cache.stats() + "\n")
+    
     def _cmd_info(self):
         cursor = self.conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        cursor.execute(TABLES_SQL)
         tables = [t[0] for t in cursor.fetchall()]
         db_size = os.path.getsize(self.db_path) / 1024
         self.write_output(
@@ -584,10 +3709,12 @@ Notes:
         """Refresh the list of tables"""
         self.tables_listbox.delete(0, tk.END)
         cursor = self.conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
+        cursor.execute(TABLES_SQL)
         tables = cursor.fetchall()
         for table in tables:
             self.tables_listbox.insert(tk.END, table[0])
+        # The list now reflects the current schema; don't let the watcher redo it
+        self._schema_version = self._read_schema_version()
     
     def on_table_select(self, event):
         """Handle table selection"""
@@ -596,6 +3723,7 @@ Notes:
             self.current_table = self.tables_listbox.get(selection[0])
             self.load_table_data()
     
+    @profiled_action
     def load_table_data(self):
         """Load data from selected table"""
         if not self.current_table:
@@ -604,10 +3732,16 @@ Notes:
         # Clear existing data
         self.data_tree.delete(*self.data_tree.get_children())
         
-        # Get column names
-        cursor = self.conn.cursor()
-        cursor.execute(f"PRAGMA table_info({self.current_table})")
-        columns = [col[1] for col in cursor.fetchall()]
+        with self.db.reader() as conn:
+            # Get column names
+            cursor = conn.execute(f"PRAGMA table_info({self.current_table})")
+            columns = [col[1] for col in cursor.fetchall()]
+            
+            # Load data (long cells as previews; the edit dialog reads full values)
+            limit = self.config.get('grid_preview_chars', 200)
+            cursor = conn.execute(
+                f"SELECT {preview_list(conn, self.current_table, limit)} FROM {self.current_table}")
+            rows = cursor.fetchall()
         
         # Configure treeview columns
         self.data_tree['columns'] = columns
@@ -620,35 +3754,35 @@ Notes:
             self.data_tree.column(col, width=150, anchor='w')
             self.data_tree.heading(col, text=col)
         
-        # Load data
-        cursor.execute(f"SELECT rowid, * FROM {self.current_table}")
-        rows = cursor.fetchall()
-        
         for row in rows:
             self.data_tree.insert('', tk.END, text=row[0], values=row[1:])
         
         self.status_bar.config(text=f"Table: {self.current_table} | Records: {len(rows)}")
+        if self.profile_visible:
+            self.update_profile_panel()
     
+    @profiled_action
     def filter_data(self):
         """Filter displayed data based on search"""
         if not self.current_table:
             return
         
-        search_term = self.search_var.get().lower()
+        search_term = self.search_var.get()
         
         # Clear existing data
         self.data_tree.delete(*self.data_tree.get_children())
         
-        # Get all data
-        cursor = self.conn.cursor()
-        cursor.execute(f"SELECT rowid, * FROM {self.current_table}")
-        rows = cursor.fetchall()
-        
-        # Filter and display
+        # SQLite matches the full values and hands back only the previews of
+        # matching rows (repeated keystrokes are served from the query cache)
+        limit = self.config.get('grid_preview_chars', 200)
+        sql = f"SELECT {preview_list(self.conn, self.current_table, limit)} FROM {self.current_table}"
+        params = ()
+        if search_term:
+            sql += f" WHERE {search_condition(self.conn, self.current_table)}"
+            params = {'pattern': search_pattern(search_term)}
+        _, rows = self.cached_query(sql, params)
         for row in rows:
-            row_str = ' '.join(str(x).lower() for x in row)
-            if search_term in row_str:
-                self.data_tree.insert('', tk.END, text=row[0], values=row[1:])
+            self.data_tree.insert('', tk.END, text=row[0], values=row[1:])
     
     def create_table_dialog(self):
         """Dialog to create a new table"""
@@ -680,8 +3814,7 @@ Notes:
             
             try:
                 sql = f"CREATE TABLE {table_name} ({columns_def})"
-                self.conn.execute(sql)
-                self.conn.commit()
+                self.db.write(sql)
                 self.refresh_tables_list()
                 dialog.destroy()
                 messagebox.showinfo("Success", f"Table '{table_name}' created!")
@@ -698,8 +3831,25 @@ Notes:
         
         if messagebox.askyesno("Confirm", f"Delete table '{self.current_table}'?"):
             try:
-                self.conn.execute(f"DROP TABLE {self.current_table}")
-                self.conn.commit()
+                table = self.current_table
+                
+                def drop(conn):
+                    summaries = list_summaries(conn)
+                    if table in [name for name, *_ in summaries]:
+                        # Its triggers live on the source table and must go too
+                        drop_summary(conn, table)
+                        return
+                    conn.execute(f"DROP TABLE {table}")
+                    for name, source, *_ in summaries:
+                        if source == table:
+                            # Keep the last figures as a plain table
+                            conn.execute(f"DELETE FROM {SUMMARIES_TABLE} WHERE name = ?", (name,))
+                    if compressed_columns(conn, table):
+                        conn.execute(f"DROP VIEW IF EXISTS {quote_ident(table + '_plain')}")
+                        conn.execute(f"DELETE FROM {INTERNAL_PREFIX}compressed_columns "
+                                     "WHERE table_name = ?", (table,))
+                
+                self.db.run_write(drop)
                 self.current_table = None
                 self.data_tree.delete(*self.data_tree.get_children())
                 self.refresh_tables_list()
@@ -735,16 +3885,18 @@ Notes:
         
         def save():
             values = {k: v.get() for k, v in entries.items()}
-            placeholders = ', '.join(['?' for _ in values])
+            placeholders = value_placeholders(values, compressed_columns(self.conn, self.current_table))
             columns_str = ', '.join(values.keys())
             
             try:
                 sql = f"INSERT INTO {self.current_table} ({columns_str}) VALUES ({placeholders})"
-                self.conn.execute(sql, list(values.values()))
-                self.conn.commit()
-                self.load_table_data()
+                limit = self.config.get('grid_preview_chars', 200)
+                # A queued insert has no rowid yet; it shows up without an ID until saved
+                self.write_record(sql, list(values.values()), lambda: self.data_tree.insert(
+                    '', tk.END, text='', values=[cell_preview(v, limit) for v in values.values()]))
                 dialog.destroy()
-                messagebox.showinfo("Success", "Record added!")
+                if not self.config.get('write_behind'):
+                    messagebox.showinfo("Success", "Record added!")
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to add record: {e}")
         
@@ -761,155 +3913,725 @@ Notes:
             messagebox.showwarning("Warning", "No record selected!")
             return
         
-        item = self.data_tree.item(selection[0])
-        rowid = item['text']
-        values = item['values']
+        item_id = selection[0]
+        rowid = self.data_tree.item(item_id)['text']
+        if self._save_pending_for(rowid):
+            return
+        
+        # The grid only holds previews, so read the full values fresh
+        with self.db.reader() as conn:
+            cursor = conn.execute(
+                f"SELECT {select_list(conn, self.current_table)} FROM {self.current_table} WHERE rowid = ?",
+                (rowid,))
+            columns = [d[0] for d in cursor.description]
+            row = cursor.fetchone()
+        if row is None:
+            messagebox.showwarning("Warning", f"Record ID {rowid} no longer exists!")
+            self.load_table_data()
+            return
         
         dialog = tk.Toplevel(self.root)
         dialog.title(f"Edit Record (ID: {rowid})")
         dialog.geometry("400x500")
         
-        # Get columns
-        cursor = self.conn.cursor()
-        cursor.execute(f"PRAGMA table_info({self.current_table})")
-        columns = [col[1] for col in cursor.fetchall()]
-        
         entries = {}
         
-        for i, col_name in enumerate(columns):
+        for col_name, value in zip(columns, row):
             frame = ttk.Frame(dialog)
             frame.pack(fill=tk.X, padx=20, pady=5)
             
             ttk.Label(frame, text=f"{col_name}:", width=20).pack(side=tk.LEFT)
             entry = ttk.Entry(frame, width=30)
-            entry.insert(0, values[i])
             entry.pack(side=tk.LEFT, padx=10)
+            if isinstance(value, bytes):
+                # Binary data cannot round-trip through a text field; leave it untouched
+                entry.insert(0, cell_preview(value, 0))
+                entry.configure(state='disabled')
+                continue
+            entry.insert(0, '' if value is None else value)
             entries[col_name] = entry
         
         def save():
             new_values = {k: v.get() for k, v in entries.items()}
-            set_clause = ', '.join([f"{k} = ?" for k in new_values.keys()])
+            set_clause = assignments(new_values, compressed_columns(self.conn, self.current_table))
             
             try:
                 sql = f"UPDATE {self.current_table} SET {set_clause} WHERE rowid = ?"
-                self.conn.execute(sql, list(new_values.values()) + [rowid])
-                self.conn.commit()
-                self.load_table_data()
+                
+                def show_pending():
+                    limit = self.config.get('grid_preview_chars', 200)
+                    columns = list(self.data_tree['columns'])
+                    shown = list(self.data_tree.item(item_id)['values'])
+                    for col, value in new_values.items():
+                        shown[columns.index(col)] = cell_preview(value, limit)
+                    self.data_tree.item(item_id, values=shown)
+                
+                self.write_record(sql, list(new_values.values()) + [rowid], show_pending)
                 dialog.destroy()
-                messagebox.showinfo("Success", "Record updated!")
+                if not self.config.get('write_behind'):
+                    messagebox.showinfo("Success", "Record updated!")
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to update record: {e}")
         
         ttk.Button(dialog, text="Save Changes", command=save).pack(pady=20)
     
+    @profiled_action
     def delete_record(self):
         """Delete selected record"""
         if not self.current_table:
             messagebox.showwarning("Warning", "No table selected!")
             return
         
-        selection = self.data_tree.selection()
-        if not selection:
-            messagebox.showwarning("Warning", "No record selected!")
-            return
+        selection = self.data_tree.selection()
+        if not selection:
+            messagebox.showwarning("Warning", "No record selected!")
+            return
+        
+        item = self.data_tree.item(selection[0])
+        rowid = item['text']
+        if rowid == '' and self._save_pending_for(rowid):
+            return
+        
+        if messagebox.askyesno("Confirm", f"Delete record ID {rowid}?"):
+            try:
+                self.write_record(f"DELETE FROM {self.current_table} WHERE rowid = ?", (rowid,),
+                                  lambda: self.data_tree.delete(selection[0]))
+                if not self.config.get('write_behind'):
+                    messagebox.showinfo("Success", "Record deleted!")
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to delete record: {e}")
+    
+    @profiled_action
+    def refresh_data(self):
+        """Refresh the current table data"""
+        if self.current_table:
+            self.load_table_data()
+    
+    # ---------- Write-behind edits ----------
+    def write_record(self, sql, params, show_pending=None):
+        """Apply a record edit from the GUI and bring the grid up to date.
+        
+        With write_behind on, the edit is only queued and written later in
+        one short transaction together with the edits around it: after
+        write_behind_ms, or as soon as write_behind_edits are queued.
+        Until then show_pending() updates the grid in place to show it.
+        """
+        if not self.config.get('write_behind'):
+            self.db.write(sql, params)
+            self.load_table_data()
+            return
+        self.db.run_write(lambda conn: conn.execute(sql, params), defer=True)
+        if show_pending is not None:
+            show_pending()
+        if self.db.pending_edits >= self.config.get('write_behind_edits', 50):
+            self.flush_edits()
+        else:
+            if not self._flush_scheduled:
+                self._flush_scheduled = True
+                self.root.after(self.config.get('write_behind_ms', 2000), self._flush_tick)
+            self._show_pending()
+    
+    def _flush_tick(self):
+        self._flush_scheduled = False
+        try:
+            self.flush_edits()
+        except sqlite3.Error as e:
+            self.status_bar.config(text=f"Could not save edits, retrying: {e}")
+            self._flush_scheduled = True
+            self.root.after(self.config.get('write_behind_ms', 2000), self._flush_tick)
+    
+    def flush_edits(self):
+        """Write queued record edits now (before exit, backup, export and maintenance)"""
+        count = self.db.flush()
+        self._show_pending()
+        errors, self.db.flush_errors = self.db.flush_errors, []
+        if errors:
+            messagebox.showerror("Edits Not Saved",
+                                 f"{len(errors)} edit(s) could not be saved: {errors[0]}")
+        if (count or errors) and self.current_table:
+            # Replace the grid's in-place previews (and ID-less new rows) with the
+            # real rows; our own commits don't move data_version, so the watcher won't
+            self._reload_visible_grid()
+        return count
+    
+    def _save_pending_for(self, rowid):
+        """Before acting on a grid row, write queued edits so the database matches the grid.
+        
+        Returns True if the row has no ID (a queued insert): the grid has
+        been reloaded with the saved rows, so the user has to pick it again.
+        """
+        pending = self.db.pending_edits
+        if pending:
+            self.flush_edits()
+        if rowid == '':
+            if not pending and self.current_table:
+                self._reload_visible_grid()
+            messagebox.showinfo("Saved", "The new record has just been saved; select it again.")
+            return True
+        return False
+    
+    def _show_pending(self):
+        pending = self.db.pending_edits
+        self.pending_label.config(text=f"✎ {pending} unsaved edit(s)" if pending else "")
+    
+    # ---------- Column profiling ----------
+    def request_profile(self, table, callback):
+        """Deliver the column profile of table to callback(profile, error).
+        
+        Cached profiles are reused while PRAGMA data_version is unchanged;
+        otherwise the profile is computed on a background thread and the
+        callback runs on the Tk thread once it's ready. Returns True if the
+        callback was answered from the cache.
+        """
+        version = self.db.data_version()
+        cached = self._profile_cache.get(table)
+        if cached and cached[0] == version and not self.conn.in_transaction:
+            callback(cached[1], None)
+            return True
+        
+        if table in self._profile_jobs:
+            self._profile_jobs[table].append(callback)
+            return False
+        self._profile_jobs[table] = [callback]
+        
+        def work():
+            try:
+                with self.db.reader(committed_only=True) as conn:
+                    result = (table, version, profile_table(conn, table), None)
+            except Exception as e:
+                result = (table, version, None, e)
+            self._profile_results.put(result)
+        
+        threading.Thread(target=work, daemon=True).start()
+        self.root.after(100, self._poll_profile_results)
+        return False
+    
+    def _poll_profile_results(self):
+        """Hand finished background profiles to their callbacks (Tk thread)"""
+        while True:
+            try:
+                table, version, profile, error = self._profile_results.get_nowait()
+            except queue.Empty:
+                break
+            if profile is not None:
+                self._profile_cache[table] = (version, profile)
+            for callback in self._profile_jobs.pop(table, []):
+                callback(profile, error)
+        if self._profile_jobs:
+            self.root.after(100, self._poll_profile_results)
+    
+    def toggle_profile_panel(self):
+        """Show or hide the column profile side panel"""
+        if self.profile_visible:
+            self.profile_frame.pack_forget()
+            self.profile_visible = False
+        else:
+            self.profile_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=(10, 0), before=self.right_panel)
+            self.profile_visible = True
+            self.update_profile_panel()
+    
+    def update_profile_panel(self):
+        """Show the current table's profile in the side panel"""
+        if not self.current_table:
+            self._set_profile_text("Select a table to profile.")
+            return
+        table = self.current_table
+        
+        def show(profile, error):
+            if self.current_table != table:
+                return
+            self._set_profile_text(f"Error: {error}" if error else format_profile(profile, width=28))
         
-        item = self.data_tree.item(selection[0])
-        rowid = item['text']
+        if not self.request_profile(table, show):
+            self._set_profile_text(f"Profiling {table}...")
+    
+    def _set_profile_text(self, text):
+        self.profile_text.configure(state='normal')
+        self.profile_text.delete('1.0', tk.END)
+        self.profile_text.insert('1.0', text)
+        self.profile_text.configure(state='disabled')
+    
+    # ---------- Delta sync ----------
+    def sync_with(self, path, tables=None, key_columns=None, direction='both',
+                  policy='skip', dry_run=False):
+        """Sync this database with another copy attached from path"""
+        if self.db.explicit_transaction:
+            raise ValueError("Commit or roll back the open transaction first")
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No such database: {path}")
+        if os.path.abspath(path) == os.path.abspath(self.db_path):
+            raise ValueError("Can't sync a database with itself")
+        if direction not in SYNC_DIRECTIONS or policy not in SYNC_POLICIES:
+            raise ValueError("Invalid direction or conflict policy")
         
-        if messagebox.askyesno("Confirm", f"Delete record ID {rowid}?"):
+        self.flush_edits()
+        with self.db.write_lock:
+            self.conn.execute("ATTACH DATABASE ? AS peer", (path,))
             try:
-                self.conn.execute(f"DELETE FROM {self.current_table} WHERE rowid = ?", (rowid,))
-                self.conn.commit()
+                if dry_run:
+                    results = sync_attached(self.conn, tables, key_columns, direction, policy, True)
+                else:
+                    results = self.db.run_write(lambda conn: sync_attached(
+                        conn, tables, key_columns, direction, policy, False))
+            finally:
+                self.conn.execute("DETACH DATABASE peer")
+        
+        if not dry_run:
+            self.refresh_tables_list()
+            if self.current_table:
                 self.load_table_data()
-                messagebox.showinfo("Success", "Record deleted!")
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to delete record: {e}")
-    
-    def refresh_data(self):
-        """Refresh the current table data"""
-        if self.current_table:
-            self.load_table_data()
+        return results
     
-    def import_csv(self):
-        """Import data from CSV file"""
+    def sync_dialog(self):
+        """Pick another copy of the database, preview the changes, then sync"""
         filepath = filedialog.askopenfilename(
-            title="Select CSV File",
-            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")]
+            title="Select Database to Sync With",
+            filetypes=[("Database files", "*.db"), ("All files", "*.*")]
         )
-        
         if not filepath:
             return
-        
-        table_name = simpledialog.askstring("Table Name", "Enter table name for imported data:")
-        if not table_name:
+        try:
+            preview = self.sync_with(filepath, dry_run=True)
+            if not messagebox.askyesno(
+                    "Confirm Sync",
+                    format_sync_results(preview, dry_run=True) +
+                    "\nApply these changes? Conflicting rows are left untouched."):
+                return
+            results = self.sync_with(filepath)
+            messagebox.showinfo("Success", format_sync_results(results))
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to sync: {e}")
+    
+    # ---------- Materialized summaries ----------
+    def create_summary(self, name, table, group_columns, aggregates):
+        """Build a summary table and its triggers in one transaction"""
+        self.db.run_write(lambda conn: create_summary(conn, name, table, group_columns, aggregates))
+        self.refresh_tables_list()
+    
+    def summary_dialog(self):
+        """Define a summary table over the current table"""
+        if not self.current_table:
+            messagebox.showwarning("Warning", "No table selected!")
             return
+        name = simpledialog.askstring("Summary Table", "Name of the new summary table:",
+                                      initialvalue=f"{self.current_table}_summary")
+        if not name:
+            return
+        groups = simpledialog.askstring(
+            "Summary Table", f"Group by which columns of '{self.current_table}'?\n"
+                             "(comma separated, empty for one grand total)")
+        if groups is None:
+            return
+        aggregates = simpledialog.askstring(
+            "Summary Table", "Aggregates, separated by spaces:\n"
+                             "count, count(col), sum(col), avg(col)", initialvalue="count")
+        if not aggregates:
+            return
+        try:
+            self.create_summary(name, self.current_table,
+                                [c.strip() for c in groups.split(',') if c.strip()],
+                                [parse_aggregate(t) for t in aggregates.split()])
+            messagebox.showinfo("Success", f"Summary table '{name}' created. It updates itself "
+                                           "whenever the source table changes.")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to create summary: {e}")
+    
+    def rebuild_summaries(self):
+        """Recompute every summary table from its source"""
+        try:
+            names = [s[0] for s in list_summaries(self.conn)]
+            for name in names:
+                self.db.run_write(lambda conn: rebuild_summary(conn, name))
+            if self.current_table in names:
+                self.load_table_data()
+            messagebox.showinfo("Success", f"Rebuilt {len(names)} summary table(s).")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to rebuild summaries: {e}")
+    
+    # ---------- Column compression ----------
+    def set_column_compression(self, table, column, enabled=True):
+        """Switch a column to (or back from) zlib-compressed storage.
+        
+        Existing values are rewritten in one transaction and the column is
+        recorded in the metadata table, so every write path compresses new
+        values and every read path decompresses them. A <table>_plain view
+        with the decompressed values is kept for ad-hoc SQL. Returns the
+        column's stored size in bytes before and after.
+        """
+        columns = [c[1] for c in self.conn.execute(f"PRAGMA table_info({quote_ident(table)})")]
+        if not columns:
+            raise ValueError(f"Table not found: {table}")
+        if column not in columns:
+            raise ValueError(f"No column '{column}' in {table}")
+        meta = f"{INTERNAL_PREFIX}compressed_columns"
+        col = quote_ident(column)
+        size_sql = f"SELECT COALESCE(SUM(length(CAST({col} AS BLOB))), 0) FROM {quote_ident(table)}"
+        
+        def apply(conn):
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {meta} "
+                         "(table_name TEXT, column_name TEXT, PRIMARY KEY (table_name, column_name))")
+            before = conn.execute(size_sql).fetchone()[0]
+            if enabled:
+                conn.execute(f"INSERT OR IGNORE INTO {meta} VALUES (?, ?)", (table, column))
+                conn.execute(f"UPDATE {quote_ident(table)} SET {col} = zcompress({col})")
+            else:
+                conn.execute(f"UPDATE {quote_ident(table)} SET {col} = zdecompress({col})")
+                conn.execute(f"DELETE FROM {meta} WHERE table_name = ? AND column_name = ?",
+                             (table, column))
+            
+            view = quote_ident(table + '_plain')
+            conn.execute(f"DROP VIEW IF EXISTS {view}")
+            if compressed_columns(conn, table):
+                conn.execute(f"CREATE VIEW {view} AS SELECT "
+                             f"{select_list(conn, table, with_rowid=True)} FROM {quote_ident(table)}")
+            return before, conn.execute(size_sql).fetchone()[0]
         
+        return self.db.run_write(apply)
+    
+    def compress_column_dialog(self):
+        """Ask for a column of the current table to compress"""
+        if not self.current_table:
+            messagebox.showwarning("Warning", "No table selected!")
+            return
+        current = compressed_columns(self.conn, self.current_table)
+        column = simpledialog.askstring(
+            "Compress Column",
+            f"Column of '{self.current_table}' to store compressed"
+            f"{' (currently: ' + ', '.join(sorted(current)) + ')' if current else ''}.\n"
+            "Enter a compressed column again to store it as plain text:")
+        if not column:
+            return
         try:
-            with open(filepath, 'r') as f:
-                reader = csv.DictReader(f)
-                columns = reader.fieldnames
-                
-                # Create table
-                columns_def = ', '.join([f"{col} TEXT" for col in columns])
-                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({columns_def})")
-                
-                # Insert data
-                for row in reader:
-                    placeholders = ', '.join(['?' for _ in columns])
-                    columns_str = ', '.join(columns)
-                    sql = f"INSERT INTO {table_name} ({columns_str}) VALUES ({placeholders})"
-                    self.conn.execute(sql, [row[col] for col in columns])
-                
-                self.conn.commit()
-                self.refresh_tables_list()
-                messagebox.showinfo("Success", f"Imported data into table '{table_name}'!")
+            before, after = self.set_column_compression(self.current_table, column,
+                                                        enabled=column not in current)
+            self.load_table_data()
+            messagebox.showinfo("Success", f"Column '{column}': {before / 1024:.1f} KB -> {after / 1024:.1f} KB")
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to import CSV: {e}")
+            messagebox.showerror("Error", f"Failed to change compression: {e}")
     
-    def import_json(self):
-        """Import data from JSON file"""
-        filepath = filedialog.askopenfilename(
-            title="Select JSON File",
-            filetypes=[("JSON files", "*.json"), ("All files", "*.*")]
-        )
+    # ---------- Idle maintenance ----------
+    def start_maintenance_scheduler(self):
+        """Track user activity and run maintenance steps while the GUI is idle"""
+        self.root.bind_all('<Any-KeyPress>', self._note_activity, add='+')
+        self.root.bind_all('<Any-ButtonPress>', self._note_activity, add='+')
+        self.root.after(5000, self._maintenance_tick)
+    
+    def _note_activity(self, event=None):
+        self._last_activity = time.time()
+    
+    def _maintenance_tick(self):
+        """Run one time-boxed step if idle; keep going quickly while work remains"""
+        delay = 5000
+        idle_for = time.time() - self._last_activity
+        if (self.config.get('maintenance_enabled', True)
+                and idle_for >= self.config.get('maintenance_idle_seconds', 30)
+                and not self.db.explicit_transaction):
+            try:
+                if self.run_maintenance_step(self.config.get('maintenance_step_ms', 100)):
+                    delay = 50
+            except sqlite3.Error:
+                pass  # busy or read-only; try again on a later tick
+        self.root.after(delay, self._maintenance_tick)
+    
+    def run_maintenance_step(self, budget_ms=100, force_optimize=False):
+        """Do at most budget_ms of maintenance (None = no limit).
         
-        if not filepath:
+        In order: PRAGMA optimize (refreshes planner statistics only where
+        they are stale), incremental_vacuum in small chunks, then a passive
+        WAL checkpoint. Returns True if more work is left for another step.
+        """
+        deadline = None if budget_ms is None else time.time() + budget_ms / 1000
+        hours = self.config.get('maintenance_optimize_hours', 24)
+        self.flush_edits()
+        with self.db.write_lock:
+            if force_optimize or time.time() - self._last_optimize >= hours * 3600:
+                # analysis_limit bounds how many rows ANALYZE looks at per index
+                self.conn.execute("PRAGMA analysis_limit=1000")
+                self.conn.execute("PRAGMA optimize")
+                self._last_optimize = time.time()
+                if deadline is not None and time.time() >= deadline:
+                    return True
+            
+            auto_vacuum = self.conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+            pages = self.config.get('maintenance_vacuum_pages', 64)
+            while auto_vacuum == 2 and self.conn.execute("PRAGMA freelist_count").fetchone()[0]:
+                # executescript steps the pragma to completion (one page per step)
+                self.conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+                if deadline is not None and time.time() >= deadline:
+                    return True
+            
+            if self.db.journal_mode == 'wal':
+                self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+        return False
+    
+    # ---------- In-memory mode ----------
+    def start_write_back_timer(self):
+        """In memory mode, save to the file every memory_save_seconds"""
+        if self.db.memory_note:
+            self.status_bar.config(text=f"Memory mode off: {self.db.memory_note}")
+        if not self.db.memory:
+            return
+        self.status_bar.config(text="Ready | Database: portable_data.db (in memory)")
+        seconds = self.config.get('memory_save_seconds', 60)
+        if seconds and seconds > 0:
+            self.root.after(int(seconds * 1000), self._write_back_tick)
+    
+    def _write_back_tick(self):
+        # An open transaction is saved once it's committed, on a later tick
+        if not self.db.explicit_transaction:
+            try:
+                self.db.save()
+            except (sqlite3.Error, OSError) as e:
+                self.status_bar.config(text=f"Could not save to disk: {e}")
+        self.root.after(int(self.config.get('memory_save_seconds', 60) * 1000),
+                        self._write_back_tick)
+    
+    def save_to_disk(self):
+        """Write the in-memory database back to its file now (File > Save to Disk)"""
+        if not self.db.memory:
+            messagebox.showinfo("Save", "Changes are already saved to the file as you go.")
             return
+        try:
+            if self.db.save():
+                self.status_bar.config(text=f"Saved to {self.db_path}")
+            else:
+                self.status_bar.config(text="No unsaved changes")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save: {e}")
+    
+    def _save_on_exit(self):
+        """Final write-back; if the file can't be replaced, keep a rescue copy"""
+        try:
+            self.db.save()
+        except (sqlite3.Error, OSError) as e:
+            rescue = os.path.join(
+                self.base_dir, f"unsaved_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db")
+            try:
+                self.db.save(rescue)
+                messagebox.showerror("Save Failed",
+                                     f"Could not update {self.db_path}: {e}\n\n"
+                                     f"Your changes were saved to {rescue}")
+            except (sqlite3.Error, OSError) as e2:
+                messagebox.showerror("Save Failed", f"Could not save your changes: {e2}")
+    
+    # ---------- External change watcher ----------
+    def _read_data_version(self):
+        """Return PRAGMA data_version (changes when another connection commits)"""
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+    
+    def _read_schema_version(self):
+        """Return PRAGMA schema_version (changes on any CREATE/DROP/ALTER)"""
+        return self.conn.execute("PRAGMA schema_version").fetchone()[0]
+    
+    def start_change_watcher(self):
+        """Start polling for changes made by other instances or scripts"""
+        self._data_version = self._read_data_version()
+        self._schema_version = self._read_schema_version()
+        interval = self.config.get('watch_interval_ms', 1000)
+        if interval and interval > 0:
+            self.root.after(interval, self._poll_external_changes)
+    
+    def _poll_external_changes(self):
+        """Refresh the tables list and visible grid only if the DB changed"""
+        try:
+            self.check_external_changes()
+        except sqlite3.Error:
+            # Database busy or being restored; try again on the next tick
+            pass
+        interval = self.config.get('watch_interval_ms', 1000)
+        if interval and interval > 0:
+            self.root.after(interval, self._poll_external_changes)
+    
+    def check_external_changes(self):
+        """Compare data/schema versions with the last poll and refresh what changed.
+        
+        Returns True if anything was refreshed. Both pragmas are answered from
+        the pager header, so an idle poll costs no table reads at all.
+        """
+        data_version = self._read_data_version()
+        schema_version = self._read_schema_version()
+        schema_changed = schema_version != self._schema_version
+        data_changed = data_version != self._data_version
+        self._data_version = data_version
+        self._schema_version = schema_version
+        
+        if schema_changed:
+            self.refresh_tables_list()
+            if self.current_table and self.current_table not in self.tables_listbox.get(0, tk.END):
+                # Table was dropped or renamed elsewhere
+                self.current_table = None
+                self.data_tree.delete(*self.data_tree.get_children())
+                self.status_bar.config(text="Ready | Database: portable_data.db")
+                return True
+        
+        if schema_changed and self.current_table:
+            # Its columns may have changed too
+            self._reload_visible_grid()
+        elif data_changed and self.current_table:
+            self._refresh_visible_rows()
+        return schema_changed or data_changed
+    
+    def _refresh_visible_rows(self):
+        """Re-read only the grid rows in view, plus rows added after the last one shown.
         
+        A commit to another table leaves these rows as they were, so the
+        cost is a rowid lookup per visible row whatever changed. Rows in
+        view that were deleted (or no longer match the search) are removed.
+        """
+        items = self.data_tree.get_children()
+        top, bottom = self.data_tree.yview()
+        first = int(top * len(items))
+        window = [i for i in items[first:math.ceil(bottom * len(items)) + 1]
+                  if self.data_tree.item(i)['text'] != '']
+        last_id = next((self.data_tree.item(i)['text'] for i in reversed(items)
+                        if self.data_tree.item(i)['text'] != ''), 0)
+        limit = self.config.get('grid_preview_chars', 200)
+        search_term = self.search_var.get()
+        params = {'pattern': search_pattern(search_term)}
+        with self.db.reader() as conn:
+            select = f"SELECT {preview_list(conn, self.current_table, limit)} FROM {self.current_table}"
+            match = f" AND ({search_condition(conn, self.current_table)})" if search_term else ""
+            ids = {str(self.data_tree.item(i)['text']): i for i in window}
+            current = {}
+            keys = list(ids)
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                marks = ', '.join(f':id{n}' for n in range(len(chunk)))
+                rows = conn.execute(f"{select} WHERE rowid IN ({marks}){match}",
+                                    dict(params, **{f'id{n}': int(k) for n, k in enumerate(chunk)}))
+                current.update((str(row[0]), row) for row in rows)
+            added = conn.execute(f"{select} WHERE rowid > :last{match} ORDER BY rowid",
+                                 dict(params, last=int(last_id))).fetchall()
+        for rowid, item in ids.items():
+            row = current.get(rowid)
+            if row is None:
+                self.data_tree.delete(item)
+            else:
+                self.data_tree.item(item, values=list(row[1:]))
+        for row in added:
+            self.data_tree.insert('', tk.END, text=row[0], values=row[1:])
+    
+    def _reload_visible_grid(self):
+        """Reload the grid keeping the search filter, selection and scroll position"""
+        selected = [self.data_tree.item(i)['text'] for i in self.data_tree.selection()]
+        yview = self.data_tree.yview()[0]
+        
+        if self.search_var.get():
+            self.filter_data()
+        else:
+            self.load_table_data()
+        
+        for item in self.data_tree.get_children():
+            if self.data_tree.item(item)['text'] in selected:
+                self.data_tree.selection_set(item)
+                break
+        self.data_tree.yview_moveto(yview)
+    
+    def import_file(self, fmt, path, table, mode='append', key_columns=None,
+                    sheet=None, all_sheets=False, resume=False, restart=False):
+        """Import a CSV, JSON, XLSX or snapshot file into table.
+        
+        CSV goes through import_csv_resumable (checkpointed, bad rows to a
+        reject file); the others are imported in one batched transaction.
+        """
+        if fmt == 'csv':
+            return import_csv_resumable(self.db, path, table, mode, key_columns, resume, restart)
+        
+        def run(conn):
+            if fmt == 'snapshot':
+                return import_snapshot(conn, path, table, mode, key_columns)
+            if fmt == 'xlsx':
+                rows = iter_xlsx_rows(path, sheet, all_sheets)
+                columns = [str(c) for c in next(rows, None) or []]
+                if not columns:
+                    raise ValueError("Sheet is empty")
+                return import_rows(conn, table, columns, rows, mode, key_columns)
+            with open(path, 'r', newline='') as f:
+                data = json.load(f)
+            if not isinstance(data, list) or not data:
+                raise ValueError("JSON must be a non-empty array of objects")
+            # Columns come from the first object
+            columns = list(data[0].keys())
+            rows = ([json.dumps(v) if isinstance(v, (dict, list)) else v
+                     for v in (row.get(col, '') for col in columns)] for row in data)
+            return import_rows(conn, table, columns, rows, mode, key_columns)
+        
+        # File is (re)opened inside so a retry after SQLITE_BUSY starts clean
+        return self.db.run_write(run)
+    
+    def _ask_import_target(self):
+        """Ask for the target table and, if it already exists, the import mode"""
         table_name = simpledialog.askstring("Table Name", "Enter table name for imported data:")
         if not table_name:
+            return None
+        exists = self.conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+                                   (table_name,)).fetchone()
+        if not exists:
+            return table_name, 'append', None
+        answer = simpledialog.askstring(
+            "Import Mode",
+            f"Table '{table_name}' already exists. How should rows be added?\n\n"
+            "  append\n  skip-duplicates [on col1,col2]\n  upsert on col1,col2",
+            initialvalue="append")
+        if answer is None:
+            return None
+        mode, key_columns = parse_import_mode(answer)
+        return table_name, mode, key_columns
+    
+    def _import_dialog(self, fmt, title, filetypes):
+        filepath = filedialog.askopenfilename(title=title, filetypes=filetypes)
+        if not filepath:
             return
-        
         try:
-            with open(filepath, 'r') as f:
-                data = json.load(f)
-            
-            if not isinstance(data, list):
-                messagebox.showerror("Error", "JSON must be an array of objects!")
-                return
-            
-            if len(data) == 0:
-                messagebox.showerror("Error", "JSON file is empty!")
+            target = self._ask_import_target()
+            if target is None:
                 return
-            
-            # Get columns from first object
-            columns = list(data[0].keys())
-            columns_def = ', '.join([f"{col} TEXT" for col in columns])
-            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({columns_def})")
-            
-            # Insert data
-            for row in data:
-                placeholders = ', '.join(['?' for _ in columns])
-                columns_str = ', '.join(columns)
-                sql = f"INSERT INTO {table_name} ({columns_str}) VALUES ({placeholders})"
-                self.conn.execute(sql, [row.get(col, '') for col in columns])
-            
-            self.conn.commit()
+            table_name, mode, key_columns = target
+            resume = restart = False
+            saved = fmt == 'csv' and import_checkpoint(self.conn, filepath, table_name)
+            if saved:
+                answer = messagebox.askyesnocancel(
+                    "Resume Import",
+                    f"An earlier import of this file into '{table_name}' stopped after "
+                    f"{saved['rows_read']} rows.\n\nYes: continue where it stopped\n"
+                    "No: remove the rows it added and import the whole file again")
+                if answer is None:
+                    return
+                resume, restart = answer, not answer
+            result = self.import_file(fmt, filepath, table_name, mode, key_columns,
+                                      resume=resume, restart=restart)
+            if resume:
+                mode = result['mode']
             self.refresh_tables_list()
-            messagebox.showinfo("Success", f"Imported data into table '{table_name}'!")
+            if self.current_table == table_name:
+                self.load_table_data()
+            messagebox.showinfo("Success", f"Imported data into table '{table_name}': "
+                                           f"{describe_import(result, mode)}.")
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to import JSON: {e}")
+            messagebox.showerror("Error", f"Failed to import {fmt.upper()}: {e}")
+    
+    @profiled_action
+    def import_csv(self):
+        """Import data from CSV file"""
+        self._import_dialog('csv', "Select CSV File", [("CSV files", "*.csv"), ("All files", "*.*")])
+    
+    @profiled_action
+    def import_json(self):
+        """Import data from JSON file"""
+        self._import_dialog('json', "Select JSON File", [("JSON files", "*.json"), ("All files", "*.*")])
+    
+    @profiled_action
+    def import_xlsx(self):
+        """Import data from the first sheet of an Excel file"""
+        self._import_dialog('xlsx', "Select Excel File", [("Excel files", "*.xlsx"), ("All files", "*.*")])
     
+    @profiled_action
+    def import_snapshot(self):
+        """Import a columnar snapshot into a table"""
+        self._import_dialog('snapshot', "Select Snapshot File",
+                            [("Snapshot files", "*" + SNAPSHOT_EXTENSION), ("All files", "*.*")])
+    
+    @profiled_action
     def export_csv(self):
         """Export current table to CSV"""
         if not self.current_table:
@@ -925,10 +4647,12 @@ Notes:
             return
         
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(f"SELECT * FROM {self.current_table}")
-            rows = cursor.fetchall()
-            columns = [description[0] for description in cursor.description]
+            self.flush_edits()
+            with self.db.reader() as conn:
+                cursor = conn.execute(
+                    f"SELECT {select_list(conn, self.current_table)} FROM {self.current_table}")
+                rows = cursor.fetchall()
+                columns = [description[0] for description in cursor.description]
             
             with open(filepath, 'w', newline='') as f:
                 writer = csv.writer(f)
@@ -939,6 +4663,7 @@ Notes:
         except Exception as e:
             messagebox.showerror("Error", f"Failed to export CSV: {e}")
     
+    @profiled_action
     def export_json(self):
         """Export current table to JSON"""
         if not self.current_table:
@@ -954,10 +4679,12 @@ Notes:
             return
         
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(f"SELECT * FROM {self.current_table}")
-            rows = cursor.fetchall()
-            columns = [description[0] for description in cursor.description]
+            self.flush_edits()
+            with self.db.reader() as conn:
+                cursor = conn.execute(
+                    f"SELECT {select_list(conn, self.current_table)} FROM {self.current_table}")
+                rows = cursor.fetchall()
+                columns = [description[0] for description in cursor.description]
             
             data = [dict(zip(columns, row)) for row in rows]
             
@@ -968,6 +4695,116 @@ Notes:
         except Exception as e:
             messagebox.showerror("Error", f"Failed to export JSON: {e}")
     
+    def export_xlsx_file(self, table, path):
+        """Stream a table into an Excel file; returns the number of rows written"""
+        self.flush_edits()
+        with self.db.reader() as conn:
+            cursor = conn.execute(f"SELECT {select_list(conn, table)} FROM {table}")
+            return write_xlsx(path, cursor, sheet_name=table)
+    
+    @profiled_action
+    def export_xlsx(self):
+        """Export current table to Excel"""
+        if not self.current_table:
+            messagebox.showwarning("Warning", "No table selected!")
+            return
+        
+        filepath = filedialog.asksaveasfilename(
+            defaultextension=".xlsx",
+            filetypes=[("Excel files", "*.xlsx"), ("All files", "*.*")]
+        )
+        
+        if not filepath:
+            return
+        
+        try:
+            count = self.export_xlsx_file(self.current_table, filepath)
+            messagebox.showinfo("Success", f"Exported {count} rows to {filepath}")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to export Excel: {e}")
+    
+    def export_snapshot_file(self, table, path):
+        """Write a table as a columnar snapshot; returns its manifest entry"""
+        self.flush_edits()
+        with self.db.reader() as conn:
+            return export_table_file(conn, table, path, 'snapshot')
+    
+    @profiled_action
+    def export_snapshot(self):
+        """Export current table as a columnar snapshot"""
+        if not self.current_table:
+            messagebox.showwarning("Warning", "No table selected!")
+            return
+        
+        filepath = filedialog.asksaveasfilename(
+            defaultextension=SNAPSHOT_EXTENSION,
+            filetypes=[("Snapshot files", "*" + SNAPSHOT_EXTENSION), ("All files", "*.*")]
+        )
+        
+        if not filepath:
+            return
+        
+        try:
+            entry = self.export_snapshot_file(self.current_table, filepath)
+            messagebox.showinfo("Success", f"Exported {entry['rows']} rows to {filepath}")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to export snapshot: {e}")
+    
+    def export_all(self, directory, fmt, callback):
+        """Export every table into directory on a background thread.
+        
+        callback(manifest, error) runs on the Tk thread when it's done.
+        """
+        self.flush_edits()
+        results = queue.Queue()
+        
+        def work():
+            try:
+                results.put((export_database(self.db, directory, fmt,
+                                             self.config.get('export_workers', 4)), None))
+            except Exception as e:
+                results.put((None, e))
+        
+        def poll():
+            try:
+                manifest, error = results.get_nowait()
+            except queue.Empty:
+                self.root.after(100, poll)
+                return
+            callback(manifest, error)
+        
+        threading.Thread(target=work, daemon=True).start()
+        self.root.after(100, poll)
+    
+    def export_all_dialog(self):
+        """Pick a folder and a format, then export every table into it"""
+        directory = filedialog.askdirectory(title="Export All Tables To")
+        if not directory:
+            return
+        fmt = simpledialog.askstring("Export Format", "Format (csv, json, ndjson or snapshot):",
+                                     initialvalue='csv')
+        if not fmt:
+            return
+        fmt = fmt.strip().lower()
+        if fmt not in EXPORT_FORMATS:
+            messagebox.showerror("Error", "Format must be csv, json, ndjson or snapshot")
+            return
+        self.status_bar.config(text=f"Exporting all tables to {directory}...")
+        
+        def done(manifest, error):
+            if error:
+                self.status_bar.config(text="Export failed")
+                messagebox.showerror("Error", f"Failed to export: {error}")
+                return
+            rows = sum(entry['rows'] for entry in manifest['tables'])
+            self.status_bar.config(text=f"Exported {len(manifest['tables'])} tables")
+            messagebox.showinfo("Success",
+                                f"Exported {len(manifest['tables'])} tables ({rows} rows) "
+                                f"to {directory} in {manifest['seconds']:.1f}s")
+        
+        self.export_all(directory, fmt, done)
+    
+    @profiled_action
     def backup_database(self):
         """Create a backup of the database"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -975,7 +4812,14 @@ Notes:
         backup_path = os.path.join(self.base_dir, backup_name)
         
         try:
-            shutil.copy2(self.db_path, backup_path)
+            self.flush_edits()
+            # Online backup: includes pages still in the WAL and is safe while
+            # other instances are writing
+            target = sqlite3.connect(backup_path)
+            try:
+                self.conn.backup(target)
+            finally:
+                target.close()
             messagebox.showinfo("Success", f"Backup created: {backup_name}")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to create backup: {e}")
@@ -992,10 +4836,17 @@ Notes:
         
         if messagebox.askyesno("Confirm", "This will replace your current database. Continue?"):
             try:
-                self.conn.close()
-                shutil.copy2(filepath, self.db_path)
-                self.conn = sqlite3.connect(self.db_path)
-                self.conn.row_factory = sqlite3.Row
+                self.flush_edits()
+                # Copy page-by-page into the live database instead of replacing
+                # the file, so pooled readers and other instances stay valid
+                source = sqlite3.connect(filepath)
+                try:
+                    with self.db.write_lock:
+                        source.backup(self.conn)
+                finally:
+                    source.close()
+                self.db.mark_dirty()
+                self._data_version = self._read_data_version()
                 self.refresh_tables_list()
                 self.data_tree.delete(*self.data_tree.get_children())
                 messagebox.showinfo("Success", "Database restored!")
@@ -1019,17 +4870,14 @@ Notes:
         def execute():
             query = query_text.get('1.0', tk.END).strip()
             try:
-                cursor = self.conn.cursor()
-                cursor.execute(query)
-                
                 if query.strip().upper().startswith('SELECT'):
-                    rows = cursor.fetchall()
+                    _, rows = self.cached_query(query)
                     result_text.delete('1.0', tk.END)
                     result_text.insert('1.0', f"Results ({len(rows)} rows):\n\n")
                     for row in rows:
                         result_text.insert(tk.END, f"{dict(row)}\n")
                 else:
-                    self.conn.commit()
+                    cursor = self.db.write(query)
                     result_text.delete('1.0', tk.END)
                     result_text.insert('1.0', f"Query executed successfully!\nRows affected: {cursor.rowcount}")
                     self.refresh_tables_list()
@@ -1039,7 +4887,23 @@ Notes:
                 result_text.delete('1.0', tk.END)
                 result_text.insert('1.0', f"Error: {e}")
         
-        ttk.Button(dialog, text="Execute Query", command=execute).pack(pady=10)
+        def explain():
+            query = query_text.get('1.0', tk.END).strip()
+            try:
+                with self.db.reader() as conn:
+                    result = explain_query(conn, query, run=run_var.get())
+                text = format_query_plan(result)
+            except Exception as e:
+                text = f"Error: {e}"
+            result_text.delete('1.0', tk.END)
+            result_text.insert('1.0', text)
+        
+        button_frame = ttk.Frame(dialog)
+        button_frame.pack(pady=10)
+        ttk.Button(button_frame, text="Execute Query", command=execute).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Explain", command=explain).pack(side=tk.LEFT, padx=5)
+        run_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(button_frame, text="Run and time it", variable=run_var).pack(side=tk.LEFT, padx=5)
     
     def set_password_dialog(self):
         """Set or change password"""
@@ -1062,10 +4926,11 @@ Notes:
         
         self.save_config()
     
+    @profiled_action
     def show_db_info(self):
         """Show database information"""
         cursor = self.conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        cursor.execute(TABLES_SQL)
         tables = cursor.fetchall()
         
         total_records = 0
@@ -1080,6 +4945,10 @@ Notes:
         
         db_size = os.path.getsize(self.db_path) / 1024  # KB
         
+        report = fragmentation_report(
+            self.conn, self.db_path,
+            scan_pages=self.conn.execute("PRAGMA page_count").fetchone()[0] <= FRAGMENTATION_SCAN_MAX_PAGES)
+        
         info = f"""Database Information:
         
 Location: {self.db_path}
@@ -1090,6 +4959,9 @@ Total Records: {total_records}
 Tables:
 {chr(10).join(table_info)}
 
+Storage:
+{chr(10).join(format_fragmentation(report))}
+
 Password Protection: {"Enabled" if self.config['password_enabled'] else "Disabled"}
 """
         
@@ -1124,9 +4996,390 @@ Created for easy, portable data management!""")
         """Start the application"""
         if not self.is_locked:
             self.root.mainloop()
-            if self.conn:
-                self.conn.close()
+            if self.db and self.db.pending_edits:
+                try:
+                    self.db.flush()
+                except sqlite3.Error as e:
+                    messagebox.showerror("Save Failed", f"Could not save your last edits: {e}")
+            if self.db and self.db.explicit_transaction:
+                commit = messagebox.askyesno(
+                    "Open Transaction", "A transaction is still open. Commit it before exiting?")
+                self.db.end(commit=commit)
+            if self.db:
+                try:
+                    # Cheap at exit: only re-analyzes tables whose stats went stale
+                    self.conn.execute("PRAGMA optimize")
+                except sqlite3.Error:
+                    pass
+                if self.db.memory:
+                    self._save_on_exit()
+                self.db.close()
+
+
+# ---------- HTTP/JSON query service (--serve) ----------
+def is_read_query(sql):
+    """True if the statement only reads (safe for a read-only connection)"""
+    words = sql.lstrip(' \t\r\n(').split(None, 1)
+    return bool(words) and words[0].upper() in ('SELECT', 'WITH', 'EXPLAIN', 'VALUES')
+
+
+def _json_default(value):
+    """Encode BLOBs as base64 text in JSON responses"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    raise TypeError(f"Not JSON serializable: {type(value).__name__}")
+
+
+class ApiError(Exception):
+    """An error reported to the HTTP client with a status code"""
+    
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """Routes the JSON API onto the shared ConnectionManager.
+    
+    Endpoints:
+      GET    /tables                               list tables
+      GET    /tables/<table>/schema                column names and types
+      GET    /tables/<table>/rows?limit=N&offset=M  rows (streamed)
+      POST   /tables/<table>/rows                  insert {"values": {...}}
+      PUT    /tables/<table>/rows/<rowid>          update {"values": {...}}
+      DELETE /tables/<table>/rows/<rowid>          delete
+      POST   /sql                                  {"query": "...", "params": [...]}
+      GET    /tables/<table>/export?format=csv|json  whole table (streamed)
+    """
+    
+    server_version = "PortableDB/1.0"
+    batch_size = 500
+    
+    routes = [
+        ('GET', re.compile(r'^/tables/?$'), 'list_tables'),
+        ('GET', re.compile(r'^/tables/([^/]+)/schema$'), 'get_schema'),
+        ('GET', re.compile(r'^/tables/([^/]+)/rows$'), 'select_rows'),
+        ('POST', re.compile(r'^/tables/([^/]+)/rows$'), 'insert_row'),
+        ('PUT', re.compile(r'^/tables/([^/]+)/rows/(\d+)$'), 'update_row'),
+        ('PATCH', re.compile(r'^/tables/([^/]+)/rows/(\d+)$'), 'update_row'),
+        ('DELETE', re.compile(r'^/tables/([^/]+)/rows/(\d+)$'), 'delete_row'),
+        ('POST', re.compile(r'^/sql$'), 'run_sql'),
+        ('GET', re.compile(r'^/tables/([^/]+)/export$'), 'export_table'),
+    ]
+    
+    def do_GET(self):
+        self._dispatch('GET')
+    
+    def do_POST(self):
+        self._dispatch('POST')
+    
+    def do_PUT(self):
+        self._dispatch('PUT')
+    
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+    
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+    
+    def log_message(self, format, *args):
+        if not getattr(self.server, 'quiet', False):
+            super().log_message(format, *args)
+    
+    @property
+    def db(self):
+        return self.server.db
+    
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self._streaming = False
+        try:
+            self._check_password()
+            for route_method, pattern, handler in self.routes:
+                match = pattern.match(url.path)
+                if match and route_method == method:
+                    # Table names arrive percent-encoded (e.g. t%20x)
+                    getattr(self, handler)(*(unquote(g) for g in match.groups()))
+                    return
+            raise ApiError(404, f"No route for {method} {url.path}")
+        except (ApiError, sqlite3.Error) as e:
+            if self._streaming:
+                # The 200 header is already out: cut the body short so the client sees an error
+                self.close_connection = True
+                return
+            if isinstance(e, ApiError):
+                self._send_json({'error': str(e)}, status=e.status)
+            else:
+                self._send_json({'error': str(e)}, status=503 if is_busy_error(e) else 400)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+    
+    def _check_password(self):
+        password_hash = self.server.password_hash
+        if not password_hash:
+            return
+        password = self.headers.get('X-DB-Password', '')
+        if hashlib.sha256(password.encode()).hexdigest() != password_hash:
+            raise ApiError(401, "Password required (X-DB-Password header)")
+    
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise ApiError(400, "Request body must be JSON")
+        if not isinstance(body, dict):
+            raise ApiError(400, "Request body must be a JSON object")
+        return body
+    
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload, default=_json_default).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def _start_stream(self, content_type):
+        # HTTP/1.0 without Content-Length: the body ends when the connection closes
+        self._streaming = True
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.end_headers()
+    
+    def _stream_json_rows(self, cursor):
+        """Write {"columns": [...], "rows": [...]} fetching rows in batches"""
+        columns = [d[0] for d in cursor.description]
+        self._start_stream('application/json')
+        self.wfile.write(('{"columns": ' + json.dumps(columns) + ', "rows": [').encode('utf-8'))
+        first = True
+        while True:
+            batch = cursor.fetchmany(self.batch_size)
+            if not batch:
+                break
+            chunk = ', '.join(json.dumps(list(row), default=_json_default) for row in batch)
+            if not first:
+                chunk = ', ' + chunk
+            first = False
+            self.wfile.write(chunk.encode('utf-8'))
+        self.wfile.write(b']}')
+    
+    def _table(self, name, conn):
+        """Validate a table name against sqlite_master and return it quoted"""
+        row = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                           (name,)).fetchone()
+        if row is None:
+            raise ApiError(404, f"Table not found: {name}")
+        return quote_ident(name)
+    
+    def _columns(self, table, conn):
+        return [c[1] for c in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+    
+    def _values(self, body, table, conn):
+        values = body.get('values')
+        if not isinstance(values, dict) or not values:
+            raise ApiError(400, 'Body must contain "values": {column: value, ...}')
+        unknown = set(values) - set(self._columns(table, conn))
+        if unknown:
+            raise ApiError(400, f"Unknown column(s): {', '.join(sorted(unknown))}")
+        return values
+    
+    def _int_param(self, name, default=None):
+        value = self.query.get(name)
+        if value is None:
+            return default
+        try:
+            return max(0, int(value))
+        except ValueError:
+            raise ApiError(400, f"Invalid {name}: {value}")
+    
+    def list_tables(self):
+        with self.db.reader() as conn:
+            rows = conn.execute(TABLES_SQL).fetchall()
+        self._send_json({'tables': [r[0] for r in rows]})
+    
+    def get_schema(self, name):
+        with self.db.reader() as conn:
+            table = self._table(name, conn)
+            cols = conn.execute(f"PRAGMA table_info({table})").fetchall()
+        self._send_json({'table': name,
+                         'columns': [{'name': c[1], 'type': c[2]} for c in cols]})
+    
+    def select_rows(self, name):
+        limit = self._int_param('limit', -1)
+        offset = self._int_param('offset', 0)
+        with self.db.reader() as conn:
+            table = self._table(name, conn)
+            cursor = conn.execute(
+                f"SELECT {select_list(conn, name, with_rowid=True)} FROM {table} LIMIT ? OFFSET ?",
+                (limit, offset))
+            self._stream_json_rows(cursor)
+    
+    def insert_row(self, name):
+        body = self._read_body()
+        
+        def insert(conn):
+            table = self._table(name, conn)
+            values = self._values(body, table, conn)
+            cols = ', '.join(quote_ident(c) for c in values)
+            placeholders = value_placeholders(values, compressed_columns(conn, name))
+            return conn.execute(f"INSERT INTO {table} ({cols}) VALUES ({placeholders})",
+                                list(values.values())).lastrowid
+        
+        self._send_json({'rowid': self.db.run_write(insert)}, status=201)
+    
+    def update_row(self, name, rowid):
+        body = self._read_body()
+        
+        def update(conn):
+            table = self._table(name, conn)
+            values = self._values(body, table, conn)
+            compressed = compressed_columns(conn, name)
+            set_clause = assignments([quote_ident(c) for c in values],
+                                     {quote_ident(c) for c in compressed})
+            return conn.execute(f"UPDATE {table} SET {set_clause} WHERE rowid = ?",
+                                list(values.values()) + [int(rowid)]).rowcount
+        
+        self._send_json({'updated': self.db.run_write(update)})
+    
+    def delete_row(self, name, rowid):
+        def delete(conn):
+            table = self._table(name, conn)
+            return conn.execute(f"DELETE FROM {table} WHERE rowid = ?", (int(rowid),)).rowcount
+        
+        self._send_json({'deleted': self.db.run_write(delete)})
+    
+    def run_sql(self):
+        body = self._read_body()
+        query = body.get('query')
+        params = body.get('params', [])
+        if not isinstance(query, str) or not query.strip():
+            raise ApiError(400, 'Body must contain "query"')
+        if not isinstance(params, (list, dict)):
+            raise ApiError(400, '"params" must be a list or object')
+        if is_read_query(query):
+            try:
+                with self.db.reader() as conn:
+                    self._stream_json_rows(conn.execute(query, params))
+                return
+            except sqlite3.OperationalError as e:
+                # e.g. WITH ... INSERT: looked like a read, needs the writer
+                if 'readonly' not in str(e):
+                    raise
+        cursor = self.db.run_write(lambda conn: conn.execute(query, params))
+        self._send_json({'rowcount': cursor.rowcount, 'lastrowid': cursor.lastrowid})
+    
+    def export_table(self, name):
+        fmt = self.query.get('format', 'json').lower()
+        if fmt not in ('csv', 'json'):
+            raise ApiError(400, "format must be 'csv' or 'json'")
+        with self.db.reader() as conn:
+            table = self._table(name, conn)
+            cursor = conn.execute(f"SELECT {select_list(conn, name)} FROM {table}")
+            columns = [d[0] for d in cursor.description]
+            if fmt == 'json':
+                self._start_stream('application/json')
+                self.wfile.write(b'[')
+                first = True
+                while True:
+                    batch = cursor.fetchmany(self.batch_size)
+                    if not batch:
+                        break
+                    chunk = ', '.join(json.dumps(dict(zip(columns, row)), default=_json_default)
+                                      for row in batch)
+                    self.wfile.write(((', ' if not first else '') + chunk).encode('utf-8'))
+                    first = False
+                self.wfile.write(b']')
+            else:
+                self._start_stream('text/csv')
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(columns)
+                while True:
+                    batch = cursor.fetchmany(self.batch_size)
+                    writer.writerows(batch)
+                    self.wfile.write(buffer.getvalue().encode('utf-8'))
+                    buffer.seek(0)
+                    buffer.truncate()
+                    if not batch:
+                        break
+
+
+class QueryServer(ThreadingHTTPServer):
+    """Threaded HTTP server sharing one ConnectionManager between request threads"""
+    
+    daemon_threads = True
+    
+    def __init__(self, address, db, password_hash=None, quiet=False):
+        super().__init__(address, QueryRequestHandler)
+        self.db = db
+        self.password_hash = password_hash
+        self.quiet = quiet
+
+
+def serve(base_dir, host=None, port=None):
+    """Run the HTTP/JSON service on portable_data.db until interrupted"""
+    config = read_config(os.path.join(base_dir, "config.json"))
+    db = ConnectionManager.from_config(os.path.join(base_dir, "portable_data.db"), config)
+    password_hash = config['password_hash'] if config.get('password_enabled') else None
+    server = QueryServer((host or config.get('serve_host', '127.0.0.1'),
+                          port or config.get('serve_port', 8765)),
+                         db, password_hash=password_hash)
+    print(f"Serving portable_data.db on http://{server.server_address[0]}:{server.server_address[1]}"
+          " (Ctrl+C to stop)")
+    stop = threading.Event()
+    if db.memory:
+        # Same write-back as the GUI: every memory_save_seconds and at shutdown
+        def write_back():
+            while not stop.wait(max(1, config.get('memory_save_seconds', 60))):
+                try:
+                    db.save()
+                except Exception as e:
+                    print(f"Write-back to disk failed: {e}", file=sys.stderr)
+        
+        threading.Thread(target=write_back, daemon=True).start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        if db.memory:
+            try:
+                db.save()
+            except Exception as e:
+                # Same as the GUI at exit: keep the changes in a rescue copy
+                rescue = os.path.join(
+                    base_dir, f"unsaved_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db")
+                try:
+                    db.save(rescue)
+                    print(f"Could not update portable_data.db: {e}\n"
+                          f"Your changes were saved to {rescue}", file=sys.stderr)
+                except Exception as e2:
+                    print(f"Could not write the in-memory database back to disk: {e2}",
+                          file=sys.stderr)
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Portable Database - USB Edition")
+    parser.add_argument('--serve', action='store_true',
+                        help="run the local HTTP/JSON query service instead of the GUI")
+    parser.add_argument('--host', help="address to listen on (default 127.0.0.1)")
+    parser.add_argument('--port', type=int, help="port to listen on (default 8765)")
+    # Ignore anything else (e.g. the -psn_ argument macOS passes to app bundles)
+    args, _ = parser.parse_known_args(argv)
+    
+    if args.serve:
+        serve(os.path.dirname(os.path.abspath(__file__)), args.host, args.port)
+    else:
+        app = PortableDatabase()
+        app.run()
+
 
 if __name__ == "__main__":
-    app = PortableDatabase()
-    app.run()
+    main()